@@ -3,18 +3,77 @@
 Lena Doc Crawler — Print every documentation page to PDF
 Targets: OpenCode, OpenClaw, Oh My OpenCode
 Uses Playwright (Chromium) headless browser for accurate rendering
+
+Pages are rendered lean: images, fonts, media and trackers are blocked, third-party
+scripts/XHR only load from allow-listed hosts, and the PDF is printed as soon as
+the main content is present and stable (no fixed sleep). Pages without real
+content are skipped. Each page logs its render time and transferred bytes.
+
+Environment:
+  CRAWL_BLOCK=0                     disable request blocking
+  CRAWL_BLOCK_TYPES=image,font,...  resource types to block
+  CRAWL_ALLOW_HOSTS=cdn.example.com extra third-party hosts allowed to load scripts/XHR
+  CRAWL_READY_TIMEOUT_MS=15000      max wait for content to be present and stable
+  CRAWL_STABLE_MS=500               how long content must stay unchanged
+  CRAWL_MIN_CHARS=200               pages with less main text are skipped as empty
+  PIPELINE_TRACE=crawl.json         per-page navigate / render / pdf_write spans (see pipeline_trace.py)
+  PIPELINE_PROFILE=render           stages to run under cProfile
 """
 
 import asyncio
 import os
 import re
 import sys
+import time
 from pathlib import Path
 from urllib.parse import urlparse
 
+from pipeline_trace import TRACE
+
 # ── Configuration ──────────────────────────────────────────────
 BASE_DIR = Path(__file__).resolve().parent.parent / "docs"
 
+# ── Lean rendering ─────────────────────────────────────────────
+BLOCK_REQUESTS = os.environ.get("CRAWL_BLOCK", "1") != "0"
+BLOCKED_RESOURCE_TYPES = set(os.environ.get(
+    "CRAWL_BLOCK_TYPES", "image,media,font,manifest,texttrack,websocket,eventsource"
+).split(","))
+EXTRA_ALLOW_HOSTS = [h.strip() for h in os.environ.get("CRAWL_ALLOW_HOSTS", "").split(",") if h.strip()]
+# Third-party hosts a site needs for rendering (stylesheets are always allowed)
+SITE_ALLOW_HOSTS = {
+    "oh-my-opencode": ["githubassets.com", "githubusercontent.com"],
+}
+# Always blocked, even when first-party or allow-listed
+TRACKER_HOSTS = [
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "segment.io",
+    "segment.com", "posthog.com", "plausible.io", "hotjar.com", "intercom.io",
+    "sentry.io", "clarity.ms", "vercel-insights.com", "mixpanel.com", "amplitude.com",
+]
+READY_TIMEOUT_MS = int(os.environ.get("CRAWL_READY_TIMEOUT_MS", "15000"))
+STABLE_MS = int(os.environ.get("CRAWL_STABLE_MS", "500"))
+MIN_CONTENT_CHARS = int(os.environ.get("CRAWL_MIN_CHARS", "200"))
+
+# True once the main content exists and its text length has not changed for `stableMs`
+READY_JS = """
+(stableMs) => {
+    if (document.readyState === 'loading') return false;
+    const root = document.querySelector('main, article, [role="main"]') || document.body;
+    if (!root) return false;
+    const len = root.innerText.length;
+    const now = performance.now();
+    const s = window.__lenaReady || (window.__lenaReady = {len: -1, since: now});
+    if (len !== s.len) { s.len = len; s.since = now; return false; }
+    return now - s.since >= stableMs;
+}
+"""
+
+CONTENT_CHARS_JS = """
+() => {
+    const root = document.querySelector('main, article, [role="main"]') || document.body;
+    return root ? root.innerText.trim().length : 0;
+}
+"""
+
 # OpenCode docs (33 pages)
 OPENCODE_PAGES = [
     "https://opencode.ai/docs",
@@ -300,19 +359,55 @@ def url_to_filename(url: str) -> str:
     return name
 
 
-async def print_page_to_pdf(page, url: str, output_dir: Path) -> bool:
-    """Navigate to URL and print to PDF."""
+def host_matches(host: str, domains: list[str]) -> bool:
+    """True if `host` is one of `domains` or a subdomain of one."""
+    return any(host == d or host.endswith("." + d) for d in domains)
+
+
+def should_block(resource_type: str, host: str, site_domain: str, allow_hosts: list[str],
+                 main_navigation: bool = False) -> bool:
+    """Decide whether a request is non-essential for printing the page."""
+    if host_matches(host, TRACKER_HOSTS):
+        return True
+    if main_navigation:
+        return False
+    if resource_type in BLOCKED_RESOURCE_TYPES:
+        return True
+    if host_matches(host, [site_domain, *allow_hosts]):
+        return False
+    # Third-party: keep stylesheets for layout, drop scripts, XHR, iframes, beacons
+    return resource_type != "stylesheet"
+
+
+async def print_page_to_pdf(page, url: str, output_dir: Path, traffic: dict | None = None) -> str:
+    """Navigate to URL and print to PDF.
+
+    Returns "saved", "exists", "empty" (no real content, nothing written) or "failed".
+    """
     filename = url_to_filename(url) + ".pdf"
     filepath = output_dir / filename
 
     if filepath.exists():
         print(f"  ⏭ SKIP (exists): {filename}")
-        return True
+        return "exists"
 
+    traffic = traffic if traffic is not None else {}
+    traffic.update(bytes=0, blocked=0)
+    start = time.perf_counter()
     try:
-        await page.goto(url, wait_until="networkidle", timeout=30000)
-        # Wait for content to render
-        await page.wait_for_timeout(2000)
+        async with TRACE.aspan("navigate", url=url):
+            await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+        async with TRACE.aspan("render", url=url) as span:
+            # Wait until the main content is present and has stopped changing
+            try:
+                await page.wait_for_function(READY_JS, arg=STABLE_MS, polling=100, timeout=READY_TIMEOUT_MS)
+            except Exception:
+                span["stable"] = False
+                print(f"  ⚠ Content not stable after {READY_TIMEOUT_MS}ms, printing anyway")
+            chars = span["chars"] = await page.evaluate(CONTENT_CHARS_JS)
+        if chars < MIN_CONTENT_CHARS:
+            print(f"  ⏭ EMPTY ({chars} chars of content): {url}")
+            return "empty"
 
         # Remove nav/sidebar for cleaner PDF
         await page.evaluate("""
@@ -341,17 +436,25 @@ async def print_page_to_pdf(page, url: str, output_dir: Path) -> bool:
             }
         """)
 
-        await page.pdf(
-            path=str(filepath),
-            format="A4",
-            print_background=True,
-            margin={"top": "1cm", "bottom": "1cm", "left": "1cm", "right": "1cm"},
+        async with TRACE.aspan("pdf_write", url=url) as span:
+            await page.pdf(
+                path=str(filepath),
+                format="A4",
+                print_background=True,
+                margin={"top": "1cm", "bottom": "1cm", "left": "1cm", "right": "1cm"},
+            )
+            span["kb"] = filepath.stat().st_size // 1024
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        traffic["render_ms"] = traffic.get("render_ms", 0.0) + elapsed_ms
+        traffic["total_bytes"] = traffic.get("total_bytes", 0) + traffic["bytes"]
+        print(
+            f"  ✅ {filename} ({filepath.stat().st_size // 1024}KB) — {elapsed_ms:.0f}ms, "
+            f"{traffic['bytes'] / 1024:.0f}KB transferred, {traffic['blocked']} requests blocked"
         )
-        print(f"  ✅ {filename} ({filepath.stat().st_size // 1024}KB)")
-        return True
+        return "saved"
     except Exception as e:
         print(f"  ❌ FAIL {url}: {e}")
-        return False
+        return "failed"
 
 
 async def crawl_site(browser, name: str, urls: list[str]):
@@ -368,18 +471,53 @@ async def crawl_site(browser, name: str, urls: list[str]):
         locale="en-US",
     )
     page = await context.new_page()
+    traffic = {"bytes": 0, "blocked": 0, "render_ms": 0.0, "total_bytes": 0}
+
+    if BLOCK_REQUESTS:
+        site_domain = ".".join((urlparse(urls[0]).hostname or "").split(".")[-2:])
+        allow_hosts = SITE_ALLOW_HOSTS.get(name, []) + EXTRA_ALLOW_HOSTS
+
+        async def route_request(route, request):
+            host = urlparse(request.url).hostname or ""
+            main_navigation = request.is_navigation_request() and request.frame == page.main_frame
+            if should_block(request.resource_type, host, site_domain, allow_hosts, main_navigation):
+                traffic["blocked"] += 1
+                await route.abort()
+            else:
+                await route.continue_()
+
+        await context.route("**/*", route_request)
+
+    # Count bytes actually received over the wire (compressed, headers included)
+    cdp = await context.new_cdp_session(page)
+    await cdp.send("Network.enable")
+    cdp.on("Network.loadingFinished",
+           lambda event: traffic.__setitem__("bytes", traffic["bytes"] + event.get("encodedDataLength", 0)))
 
     success = 0
     failed = 0
+    empty = 0
     for i, url in enumerate(urls, 1):
         print(f"[{i}/{len(urls)}] {url}")
-        if await print_page_to_pdf(page, url, output_dir):
-            success += 1
-        else:
+        async with TRACE.aspan("page", site=name, url=url) as span:
+            status = span["status"] = await print_page_to_pdf(page, url, output_dir, traffic)
+            if status != "exists":
+                span["bytes"] = traffic["bytes"]
+                span["blocked"] = traffic["blocked"]
+        if status == "failed":
             failed += 1
+        elif status == "empty":
+            empty += 1
+        else:
+            success += 1
 
     await context.close()
-    print(f"\n✅ {name}: {success} saved, {failed} failed out of {len(urls)} total")
+    print(f"\n✅ {name}: {success} saved, {empty} empty, {failed} failed out of {len(urls)} total")
+    if traffic["render_ms"]:
+        print(
+            f"📊 {traffic['render_ms'] / 1000:.1f}s rendering, "
+            f"{traffic['total_bytes'] / 1024 / 1024:.1f}MB transferred for printed pages"
+        )
     return success, failed
 
 
@@ -401,12 +539,14 @@ async def main():
             ("openclaw", OPENCLAW_PAGES),
             ("oh-my-opencode", OH_MY_OPENCODE_PAGES),
         ]:
-            s, f = await crawl_site(browser, name, urls)
+            async with TRACE.aspan("site", site=name, pages=len(urls)):
+                s, f = await crawl_site(browser, name, urls)
             total_success += s
             total_failed += f
 
         await browser.close()
 
+    TRACE.close()
     print(f"\n{'='*60}")
     print(f"🏁 DONE: {total_success} PDFs saved, {total_failed} failed")
     print(f"📁 All PDFs in: {BASE_DIR}")
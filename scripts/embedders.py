@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Lena Embedders — pluggable embedding backends
+Shared by vectorize_docs.py (indexing) and mcp_vector_search.py (queries).
+
+Backends (EMBED_BACKEND):
+  - ollama  : Ollama /api/embed over a pooled keep-alive session, batched inputs (default),
+              with model keep_alive, warmup, adaptive timeouts and a circuit breaker
+  - local   : in-process CPU model via sentence-transformers, loaded once,
+              batched multi-threaded inference (EMBED_LOCAL_RUNTIME=onnx for ONNX Runtime)
+  - hashing : deterministic feature-hashing embedder, no model or network (tests / CI)
+
+Every index records `Embedder.info()` next to the vectors so that queries are
+never embedded by a different backend or model than the one that built it.
+
+Requires:
+  ollama  → pip install requests
+  local   → pip install sentence-transformers  (+ onnxruntime for the ONNX runtime)
+"""
+
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+
+# ── Config ─────────────────────────────────────────────────────
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")  # keep the model resident between queries
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "2"))
+OLLAMA_TIMEOUT_MIN = float(os.environ.get("OLLAMA_TIMEOUT_MIN", "2"))
+OLLAMA_TIMEOUT_MAX = float(os.environ.get("OLLAMA_TIMEOUT_MAX", "30"))  # per text; also used while the model is cold
+OLLAMA_INDEX_TIMEOUT = float(os.environ.get("OLLAMA_INDEX_TIMEOUT", "120"))  # per text cap for vectorize_docs.py
+OLLAMA_TIMEOUT_FACTOR = float(os.environ.get("OLLAMA_TIMEOUT_FACTOR", "4"))  # × p95 per-text latency
+OLLAMA_BREAKER_FAILURES = int(os.environ.get("OLLAMA_BREAKER_FAILURES", "3"))
+OLLAMA_BREAKER_COOLDOWN = float(os.environ.get("OLLAMA_BREAKER_COOLDOWN", "15"))
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "ollama")
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "16"))
+EMBED_THREADS = int(os.environ.get("EMBED_THREADS", str(os.cpu_count() or 1)))
+EMBED_LOCAL_RUNTIME = os.environ.get("EMBED_LOCAL_RUNTIME", "torch")  # torch | onnx
+HASHING_DIM = int(os.environ.get("EMBED_DIM", "512"))
+
+DEFAULT_MODELS = {
+    "ollama": "qwen3-embedding:8b",  # 4096-d, #1 MTEB
+    "local": "sentence-transformers/all-MiniLM-L6-v2",  # 384-d, ~90MB, fast on CPU
+    "hashing": "hashing-v1",
+}
+
+
+def parse_keep_alive(value: str) -> float | None:
+    """Seconds Ollama keeps an idle model loaded for a keep_alive value ("30m", "1h", "300"); None = forever."""
+    match = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*(ms|s|m|h)?\s*", str(value))
+    if not match:
+        return None
+    seconds = float(match.group(1)) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}[match.group(2)]
+    return None if seconds < 0 else seconds
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a backend that has been failing."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} circuit open, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed → open after `failures` consecutive errors; one trial call after `cooldown`."""
+
+    def __init__(self, name: str, failures: int = OLLAMA_BREAKER_FAILURES,
+                 cooldown: float = OLLAMA_BREAKER_COOLDOWN):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through now."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            waited = time.monotonic() - self.opened_at
+            if waited < self.cooldown or self.trial:
+                raise CircuitOpenError(self.name, max(0.0, self.cooldown - waited))
+            self.trial = True  # let exactly one probe through
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive += 1
+            if self.trial or self.consecutive >= self.failures:
+                if self.opened_at is None or self.trial:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+
+class Embedder:
+    """Base class: turns a batch of texts into a batch of vectors."""
+
+    backend = "base"
+
+    def __init__(self, model: str, batch_size: int = EMBED_BATCH_SIZE):
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.dim = None
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        """Embed many texts, splitting them into backend-sized batches."""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]))
+        if vectors and self.dim is None:
+            self.dim = len(vectors[0])
+        return vectors
+
+    def embed_one(self, text: str) -> list[float]:
+        return self.embed([text])[0]
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        raise NotImplementedError
+
+    def check(self):
+        """Raise RuntimeError if the backend cannot serve embeddings."""
+
+    def warmup(self) -> float:
+        """Load the model ahead of the first real query; returns seconds taken."""
+        start = time.perf_counter()
+        self.embed_one("warmup")
+        return time.perf_counter() - start
+
+    def stats(self) -> dict:
+        """Backend health numbers for server_stats."""
+        return {}
+
+    def info(self) -> dict:
+        """Identity of the vector space, stored alongside every index."""
+        return {"backend": self.backend, "model": self.model, "dim": self.dim}
+
+    def describe(self) -> str:
+        return f"{self.model} ({self.backend})"
+
+
+class OllamaEmbedder(Embedder):
+    """Ollama /api/embed with a pooled HTTP session and batched `input` lists.
+
+    Asks Ollama to keep the model resident (`keep_alive`), sizes the read
+    timeout from recent warm latencies instead of a flat two minutes, and stops
+    calling a failing Ollama for a cooldown period (circuit breaker) so that
+    callers fail fast during outages.
+    """
+
+    backend = "ollama"
+
+    def __init__(self, model: str, host: str = OLLAMA_HOST, batch_size: int = EMBED_BATCH_SIZE,
+                 keep_alive: str = OLLAMA_KEEP_ALIVE, timeout_max: float = OLLAMA_TIMEOUT_MAX):
+        super().__init__(model, batch_size)
+        self.timeout_max = timeout_max
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.host = host.rstrip("/")
+        self.keep_alive = keep_alive
+        self.keep_alive_s = parse_keep_alive(keep_alive)
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=8))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=8))
+        self.breaker = CircuitBreaker(f"Ollama {self.host}")
+        self._latencies = deque(maxlen=64)  # warm seconds per text, model load excluded
+        self._cold = True
+        self._last_ok = 0.0  # monotonic time of the last successful call
+
+    def read_timeout(self, n_texts: int) -> float:
+        """Generous while the model may be loading, otherwise a multiple of recent p95.
+
+        The cap is `timeout_max` per text, so large indexing batches get proportionally longer.
+        """
+        cap = self.timeout_max * max(1, n_texts)
+        if self.is_cold() or len(self._latencies) < 5:
+            return cap
+        p95 = sorted(self._latencies)[int(0.95 * (len(self._latencies) - 1))]
+        return min(cap, max(OLLAMA_TIMEOUT_MIN, OLLAMA_TIMEOUT_FACTOR * p95 * n_texts))
+
+    def is_cold(self) -> bool:
+        """True if the model may need loading: never used, after an error, or idle past keep_alive."""
+        if self._cold:
+            return True
+        # Ollama unloads the model once keep_alive passes without a request (10% margin)
+        return self.keep_alive_s is not None and time.monotonic() - self._last_ok > 0.9 * self.keep_alive_s
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        self.breaker.before_call()
+        start = time.perf_counter()
+        try:
+            resp = self.session.post(
+                f"{self.host}/api/embed",
+                json={"model": self.model, "input": texts, "keep_alive": self.keep_alive},
+                timeout=(OLLAMA_CONNECT_TIMEOUT, self.read_timeout(len(texts))),
+            )
+            resp.raise_for_status()
+            data = resp.json()
+        except Exception:
+            self.breaker.record_failure()
+            self._cold = True  # Ollama may have restarted and dropped the model
+            raise
+        self.breaker.record_success()
+
+        # Ollama reports model load time in ns; keep it out of the warm latency samples
+        load = data.get("load_duration", 0) / 1e9
+        self._latencies.append(max(0.0, time.perf_counter() - start - load) / len(texts))
+        self._cold = False
+        self._last_ok = time.monotonic()
+        # Ollama returns {"embeddings": [[...], ...]} in input order
+        return data["embeddings"]
+
+    def stats(self) -> dict:
+        return {
+            "ollama_breaker_open": 0 if self.breaker.state == "closed" else 1,
+            "ollama_breaker_trips": self.breaker.trips,
+            "ollama_read_timeout_s": round(self.read_timeout(1), 3),
+        }
+
+    def check(self):
+        try:
+            resp = self.session.get(f"{self.host}/api/tags", timeout=5)
+            models = [m["name"] for m in resp.json().get("models", [])]
+        except Exception as e:
+            raise RuntimeError(f"Cannot reach Ollama at {self.host}: {e}") from e
+        if not any(self.model in m for m in models):
+            raise RuntimeError(
+                f"Model {self.model} not found. Available: {models}\n"
+                f"  Run: ollama pull {self.model}"
+            )
+
+    def describe(self) -> str:
+        return f"{self.model} via {self.host}"
+
+
+class LocalEmbedder(Embedder):
+    """In-process CPU embeddings via sentence-transformers, model loaded once."""
+
+    backend = "local"
+
+    def __init__(self, model: str, batch_size: int = EMBED_BATCH_SIZE,
+                 threads: int = EMBED_THREADS, runtime: str = EMBED_LOCAL_RUNTIME):
+        super().__init__(model, batch_size)
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError("Local embedder requires: pip install sentence-transformers") from e
+
+        self.runtime = runtime
+        if runtime == "onnx":
+            self._model = SentenceTransformer(
+                model, device="cpu", backend="onnx",
+                model_kwargs={"provider": "CPUExecutionProvider"},
+            )
+        else:
+            import torch
+            torch.set_num_threads(max(1, threads))
+            self._model = SentenceTransformer(model, device="cpu")
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        # sentence-transformers batches internally; one call keeps the threads busy
+        return self._embed_batch(texts)
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        vectors = self._model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        return vectors.tolist()
+
+    def info(self) -> dict:
+        return {**super().info(), "runtime": self.runtime}
+
+    def describe(self) -> str:
+        return f"{self.model} (local CPU, {self.runtime})"
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic signed feature hashing of word uni/bigrams, L2-normalized.
+
+    Needs no model and no network, and gives identical vectors on every machine,
+    so tests and dry runs can exercise the full index/search path.
+    """
+
+    backend = "hashing"
+
+    def __init__(self, model: str = DEFAULT_MODELS["hashing"], dim: int = HASHING_DIM,
+                 batch_size: int = EMBED_BATCH_SIZE):
+        super().__init__(model, batch_size)
+        self.dim = dim
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed_text(t) for t in texts]
+
+    def _embed_text(self, text: str) -> list[float]:
+        vec = [0.0] * self.dim
+        words = re.findall(r"\w+", text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for feature in features:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+            vec[digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec))
+        return [v / norm for v in vec] if norm else vec
+
+
+BACKENDS = {
+    "ollama": OllamaEmbedder,
+    "local": LocalEmbedder,
+    "hashing": HashingEmbedder,
+}
+
+
+def get_embedder(backend: str = None, model: str = None, bulk: bool = False) -> Embedder:
+    """Build the embedder selected by EMBED_BACKEND / EMBED_MODEL (or the arguments).
+
+    `bulk` is for indexing: Ollama batches may take up to OLLAMA_INDEX_TIMEOUT
+    per text instead of the interactive OLLAMA_TIMEOUT_MAX.
+    """
+    backend = backend or EMBED_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown EMBED_BACKEND {backend!r}; choose from {', '.join(BACKENDS)}")
+    model = model or os.environ.get("EMBED_MODEL") or DEFAULT_MODELS[backend]
+    if backend == "ollama" and bulk:
+        return OllamaEmbedder(model, timeout_max=OLLAMA_INDEX_TIMEOUT)
+    return BACKENDS[backend](model)
+
+
+def incompatibility(index_info: dict, embedder: Embedder) -> str | None:
+    """Describe why `embedder` must not query an index built with `index_info`, if it must not."""
+    current = embedder.info()
+    for key in ("backend", "model"):
+        if index_info.get(key) != current[key]:
+            return (
+                f"index was built with {index_info.get('backend')}:{index_info.get('model')} "
+                f"but queries use {current['backend']}:{current['model']} — "
+                f"rebuild with vectorize_docs.py or set EMBED_BACKEND/EMBED_MODEL to match"
+            )
+    if current.get("dim") and index_info.get("dim") and index_info["dim"] != current["dim"]:
+        return f"index dimension {index_info['dim']} != embedder dimension {current['dim']}"
+    return None
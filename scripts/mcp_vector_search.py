@@ -4,147 +4,1123 @@ Lena MCP Vector Search Server
 Exposes FAISS index over the MCP (Model Context Protocol) stdio transport.
 
 Usage:
-  python3 mcp_vector_search.py
+  python3 mcp_vector_search.py              # stdio proxy to the shared daemon (auto-started)
+  python3 mcp_vector_search.py --daemon     # run the shared search daemon in the foreground
+  python3 mcp_vector_search.py --no-daemon  # standalone stdio server (also SEARCH_DAEMON=0)
+
+Every opencode session/agent starts its own stdio process. By default that
+process is a thin proxy: the index, caches and Ollama connection pool live
+once in a long-lived daemon on a Unix socket (SEARCH_DAEMON_SOCKET) shared by
+all sessions. The first proxy starts the daemon with its own environment.
+The socket lives in a per-user directory (default $XDG_RUNTIME_DIR or /tmp,
+lena-docs-search-<uid>/) that must not be writable by other users, and proxies
+only connect to a socket owned by their own user.
 
 Tools exposed:
   - search_docs: Semantic search over OpenCode/OpenClaw/Oh My OpenCode documentation
+                 (snippets + chunk IDs, cursor-based pagination)
+  - get_chunks: Full text of chunks by ID, optionally with neighbouring chunks (no embedding call)
+  - server_stats: Per-stage latency histograms, request/error counts, cache hit rates
+
+Stats export (optional):
+  STATS_EXPORT_PATH=/tmp/lena_docs.prom    # Prometheus textfile (*.prom)
+  STATS_EXPORT_PATH=/tmp/lena_docs.jsonl   # one JSON snapshot per line
+  STATS_EXPORT_INTERVAL=60                 # seconds between dumps
+
+Collections:
+  ../vectordb/collections.json names the corpora to serve (written by
+  vectorize_docs.py --collection); without it the single `docs` index is served.
+  Each collection <name> lives in <name>.faiss + <name>_metadata.json +
+  <name>_index_info.json and is queried with the embedder recorded there.
+  Collections load on first query; with SEARCH_MEMORY_BUDGET_MB set, the least
+  recently used ones are unloaded to stay within the budget. A collection whose
+  files change on disk (vectorize_docs.py rerun) is reloaded on its next query,
+  so a running daemon never has to be restarted after a rebuild.
+
+Embedding backend (see embedders.py):
+  EMBED_BACKEND=ollama|local|hashing, EMBED_MODEL=<model> for indexes without
+  a recorded embedder; must match the backend/model recorded in <name>_index_info.json.
+  The model is warmed up at startup (EMBED_WARMUP=0 to skip). While Ollama is
+  down (circuit breaker open), repeated queries are served from the embedding
+  cache and new ones from a keyword index (SEARCH_FALLBACK=none to fail fast).
+
+Query cache:
+  Reworded queries ("how do I configure MCP servers" / "configure mcp server
+  opencode") skip the index search when their embedding is within
+  SEARCH_QUERY_CACHE_THRESHOLD cosine of a recent query's (default 0.95); that
+  query's ranked hits are reused. Up to SEARCH_QUERY_CACHE_SIZE queries are kept
+  per collection (LRU, 0 disables) and dropped whenever the collection is unloaded
+  or reloaded.
+
+Diversification (search_docs `diversify`, default SEARCH_DIVERSIFY=0):
+  Over-fetches SEARCH_CANDIDATES × top_k hits, re-ranks them with Maximal Marginal
+  Relevance over their stored vectors (SEARCH_MMR_LAMBDA, 1 = relevance only) and
+  keeps at most SEARCH_PER_SOURCE_CAP chunks per source (0 = no cap), so
+  overlapping chunks of one page do not crowd out the rest.
 
 Requires:
   pip install faiss-cpu PyPDF2 requests
   Pre-built index in ../vectordb/docs.faiss + ../vectordb/docs_metadata.json
 """
 
+import base64
+import bisect
+import fcntl
 import json
+import math
 import os
+import re
+import signal
+import socket
+import socketserver
+import stat
+import subprocess
 import sys
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
 
-import requests
+from embedders import get_embedder, incompatibility
 
 # ── Config ─────────────────────────────────────────────────────
-OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
-EMBED_MODEL = os.environ.get("EMBED_MODEL", "qwen3-embedding:8b")
 TOP_K = int(os.environ.get("SEARCH_TOP_K", "5"))
+SNIPPET_CHARS = int(os.environ.get("SEARCH_SNIPPET_CHARS", "500"))
+MAX_DEPTH = int(os.environ.get("SEARCH_MAX_DEPTH", "100"))  # deepest rank reachable by paging
+MAX_NEIGHBORS = 3
+SEARCH_FALLBACK = os.environ.get("SEARCH_FALLBACK", "lexical")  # lexical | none
+EMBED_WARMUP = os.environ.get("EMBED_WARMUP", "1") != "0"
+EMBED_CACHE_SIZE = int(os.environ.get("EMBED_CACHE_SIZE", "256"))
+QUERY_CACHE_SIZE = int(os.environ.get("SEARCH_QUERY_CACHE_SIZE", "256"))  # per collection, 0 = off
+QUERY_CACHE_THRESHOLD = float(os.environ.get("SEARCH_QUERY_CACHE_THRESHOLD", "0.95"))  # cosine similarity
+DIVERSIFY = os.environ.get("SEARCH_DIVERSIFY", "0") == "1"  # default for the search_docs `diversify` flag
+MMR_LAMBDA = float(os.environ.get("SEARCH_MMR_LAMBDA", "0.7"))  # relevance vs. novelty
+PER_SOURCE_CAP = int(os.environ.get("SEARCH_PER_SOURCE_CAP", "2"))  # 0 = no cap
+CANDIDATES = int(os.environ.get("SEARCH_CANDIDATES", "4"))  # over-fetch factor when diversifying
+STATS_EXPORT_PATH = os.environ.get("STATS_EXPORT_PATH", "")
+STATS_EXPORT_INTERVAL = float(os.environ.get("STATS_EXPORT_INTERVAL", "60"))
+
+DAEMON_ENABLED = os.environ.get("SEARCH_DAEMON", "1") != "0"
+# Socket, lock and log live in a directory only this user can enter (checked before use)
+DAEMON_SOCKET = os.environ.get("SEARCH_DAEMON_SOCKET") or str(
+    Path(os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()) / f"lena-docs-search-{os.getuid()}" / "search.sock"
+)
+DAEMON_START_TIMEOUT = float(os.environ.get("SEARCH_DAEMON_START_TIMEOUT", "120"))
+DAEMON_IDLE_TIMEOUT = float(os.environ.get("SEARCH_DAEMON_IDLE_TIMEOUT", "0"))  # seconds, 0 = never exit
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 VECTORDB_DIR = BASE_DIR / "vectordb"
-INDEX_PATH = VECTORDB_DIR / "docs.faiss"
-META_PATH = VECTORDB_DIR / "docs_metadata.json"
+MANIFEST_PATH = VECTORDB_DIR / "collections.json"
+DEFAULT_COLLECTION = "docs"
+MEMORY_BUDGET_MB = float(os.environ.get("SEARCH_MEMORY_BUDGET_MB", "0"))  # 0 = unlimited
+SEARCH_PRELOAD = os.environ.get("SEARCH_PRELOAD", "")  # collections loaded at startup (default: the default one)
 
-# ── MCP Protocol ───────────────────────────────────────────────
+# ── Metrics ────────────────────────────────────────────────────
 
-def send_response(response_id, result):
-    """Send JSON-RPC response to stdout."""
-    msg = {"jsonrpc": "2.0", "id": response_id, "result": result}
-    out = json.dumps(msg)
-    sys.stdout.write(f"Content-Length: {len(out)}\r\n\r\n{out}")
-    sys.stdout.flush()
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is +Inf.
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
 
 
-def send_error(response_id, code, message):
-    """Send JSON-RPC error response."""
-    msg = {"jsonrpc": "2.0", "id": response_id, "error": {"code": code, "message": message}}
-    out = json.dumps(msg)
-    sys.stdout.write(f"Content-Length: {len(out)}\r\n\r\n{out}")
-    sys.stdout.flush()
+class Histogram:
+    """Fixed-bucket latency histogram (Prometheus-style, cumulative on export)."""
 
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
 
-def get_embedding(text: str) -> list[float]:
-    """Get embedding from Ollama."""
-    resp = requests.post(
-        f"{OLLAMA_HOST}/api/embed",
-        json={"model": EMBED_MODEL, "input": text},
-        timeout=120,
-    )
-    resp.raise_for_status()
-    return resp.json()["embeddings"][0]
+    def observe(self, value_ms: float):
+        self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        if value_ms > self.max:
+            self.max = value_ms
 
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by linear interpolation inside its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.max
+            if n and seen + n >= rank:
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+            lower = upper
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum_ms": round(self.total, 3),
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.50), 3),
+            "p95_ms": round(self.quantile(0.95), 3),
+            "p99_ms": round(self.quantile(0.99), 3),
+            "max_ms": round(self.max, 3),
+        }
+
+
+class Metrics:
+    """Process-wide counters, cache stats and per-stage latency histograms.
+
+    Every update is a dict lookup plus a few integer ops under one lock, so the
+    overhead is a couple of microseconds per stage — cheap enough to leave on.
+    """
 
-class VectorSearchServer:
     def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.stages: dict[str, Histogram] = {}
+        self.counters: dict[str, dict[str, int]] = {}
+        self.caches: dict[str, list[int]] = {}
+        self.gauge_fns = []
+        self._exporter = None
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Time the enclosed block into the `stage` histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - start) * 1000)
+
+    def observe(self, stage: str, value_ms: float):
+        with self._lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = Histogram()
+            hist.observe(value_ms)
+
+    def inc(self, name: str, label: str = "", n: int = 1):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[label] = series.get(label, 0) + n
+
+    def record_cache(self, name: str, hit: bool):
+        with self._lock:
+            stats = self.caches.setdefault(name, [0, 0])
+            stats[0 if hit else 1] += 1
+
+    def add_gauges(self, fn):
+        """Register a callable returning {name: number}, sampled on snapshot."""
+        self.gauge_fns.append(fn)
+
+    def snapshot(self) -> dict:
+        gauges = {"rss_bytes": _rss_bytes()}
+        for fn in self.gauge_fns:
+            try:
+                gauges.update(fn())
+            except Exception as e:
+                sys.stderr.write(f"⚠ Gauge sampling failed: {e}\n")
+        with self._lock:
+            return {
+                "timestamp": round(time.time(), 3),
+                "uptime_s": round(time.time() - self.started, 3),
+                "stages": {k: h.snapshot() for k, h in self.stages.items()},
+                "counters": {k: dict(v) for k, v in self.counters.items()},
+                "caches": {
+                    k: {"hits": h, "misses": m, "hit_rate": round(h / (h + m), 4) if h + m else 0.0}
+                    for k, (h, m) in self.caches.items()
+                },
+                "gauges": gauges,
+            }
+
+    def to_prometheus(self) -> str:
+        """Render the current state in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = []
+        with self._lock:
+            hists = [(k, list(h.counts), h.total, h.count) for k, h in self.stages.items()]
+        lines.append("# TYPE lena_docs_stage_duration_ms histogram")
+        for stage, counts, total, count in hists:
+            cumulative = 0
+            for bound, n in zip(list(LATENCY_BUCKETS_MS) + ["+Inf"], counts):
+                cumulative += n
+                lines.append(f'lena_docs_stage_duration_ms_bucket{{stage="{_label(stage)}",le="{bound}"}} {cumulative}')
+            lines.append(f'lena_docs_stage_duration_ms_sum{{stage="{_label(stage)}"}} {total:.3f}')
+            lines.append(f'lena_docs_stage_duration_ms_count{{stage="{_label(stage)}"}} {count}')
+        for name, series in snap["counters"].items():
+            lines.append(f"# TYPE lena_docs_{name}_total counter")
+            for label, value in series.items():
+                suffix = f'{{kind="{_label(label)}"}}' if label else ""
+                lines.append(f"lena_docs_{name}_total{suffix} {value}")
+        lines.append("# TYPE lena_docs_cache_requests_total counter")
+        for name, stats in snap["caches"].items():
+            lines.append(f'lena_docs_cache_requests_total{{cache="{_label(name)}",result="hit"}} {stats["hits"]}')
+            lines.append(f'lena_docs_cache_requests_total{{cache="{_label(name)}",result="miss"}} {stats["misses"]}')
+        for name, value in snap["gauges"].items():
+            lines.append(f"# TYPE lena_docs_{name} gauge")
+            lines.append(f"lena_docs_{name} {value}")
+        lines.append(f"lena_docs_uptime_seconds {snap['uptime_s']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Path):
+        """Write a Prometheus textfile (*.prom, atomic replace) or append a JSONL snapshot."""
+        if path.suffix == ".prom":
+            tmp = path.with_name(path.name + ".tmp")
+            tmp.write_text(self.to_prometheus())
+            os.replace(tmp, path)
+        else:
+            with open(path, "a") as f:
+                f.write(json.dumps(self.snapshot()) + "\n")
+
+    def start_exporter(self, path: str, interval: float):
+        """Dump stats to `path` every `interval` seconds from a daemon thread."""
+        target = Path(path).expanduser()
+        stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    self.export(target)
+                except Exception as e:
+                    sys.stderr.write(f"⚠ Stats export to {target} failed: {e}\n")
+
+        thread = threading.Thread(target=loop, name="stats-exporter", daemon=True)
+        thread.start()
+        self._exporter = stop
+        sys.stderr.write(f"📈 Stats export: {target} every {interval:g}s\n")
+
+
+def _label(value) -> str:
+    """Escape a Prometheus label value (backslash, double quote, newline)."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _rss_bytes() -> int:
+    """Current resident set size of this process (peak RSS if /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+METRICS = Metrics()
+
+
+# ── MCP Protocol ───────────────────────────────────────────────
+
+def _write_message(msg: dict):
+    """Frame and write a JSON-RPC message to stdout."""
+    with METRICS.timer("write"):
+        out = json.dumps(msg)
+        sys.stdout.write(f"Content-Length: {len(out)}\r\n\r\n{out}")
+        sys.stdout.flush()
+
+
+def make_response(response_id, result) -> dict:
+    """Build a JSON-RPC response."""
+    return {"jsonrpc": "2.0", "id": response_id, "result": result}
+
+
+def make_error(response_id, code, message) -> dict:
+    """Build a JSON-RPC error response."""
+    METRICS.inc("errors", "rpc")
+    return {"jsonrpc": "2.0", "id": response_id, "error": {"code": code, "message": message}}
+
+
+def serve_stdio(handle):
+    """Run the MCP stdio loop, answering each request with `handle(request)`.
+
+    `handle` returns the JSON-RPC response dict, or None for notifications.
+    """
+    buffer = ""
+    content_length = None
+
+    while True:
+        try:
+            line = sys.stdin.readline()
+            if not line:
+                break
+
+            buffer += line
+
+            # Parse Content-Length header
+            if content_length is None:
+                if buffer.startswith("Content-Length: "):
+                    content_length = int(buffer.split(":")[1].strip())
+                    buffer = ""
+                elif buffer == "\r\n" or buffer == "\n":
+                    buffer = ""
+                continue
+
+            # Skip empty line after header
+            if buffer.strip() == "":
+                buffer = ""
+                continue
+
+            # Try to parse JSON body
+            if len(buffer.encode()) >= content_length:
+                body = buffer[:content_length]
+                buffer = ""
+                content_length = None
+                try:
+                    request = json.loads(body)
+                except json.JSONDecodeError as e:
+                    METRICS.inc("errors", "parse")
+                    sys.stderr.write(f"JSON parse error: {e}\n")
+                    continue
+                response = handle_safely(handle, request)
+                if response is not None:
+                    _write_message(response)
+
+        except KeyboardInterrupt:
+            break
+        except Exception as e:
+            # Drop the partial message so the next one parses cleanly
+            buffer = ""
+            content_length = None
+            METRICS.inc("errors", "internal")
+            sys.stderr.write(f"Error: {e}\n")
+
+
+def handle_safely(handle, request) -> dict | None:
+    """`handle(request)`, turning an unexpected exception into a JSON-RPC internal error."""
+    try:
+        return handle(request)
+    except Exception as e:
+        METRICS.inc("errors", "internal")
+        sys.stderr.write(f"Error handling request: {e!r}\n")
+        if not isinstance(request, dict) or "id" not in request:
+            return None  # notification: nothing to answer
+        return make_error(request["id"], -32603, f"Internal error: {e}")
+
+
+def encode_cursor(query: str, top_k: int, offset: int, section: str | None,
+                  collection: str | None = None, diversify: bool = False) -> str:
+    """Opaque pagination cursor: the query and where the next page starts."""
+    state = {"query": query, "top_k": top_k, "offset": offset, "section": section,
+             "collection": collection, "diversify": diversify}
+    return base64.urlsafe_b64encode(json.dumps(state).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    if not isinstance(cursor, str):
+        raise ValueError("cursor must be a string")
+    state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    if not isinstance(state, dict):
+        raise ValueError("not a search_docs cursor")
+    if not isinstance(state.get("offset"), int) or state["offset"] < 0:
+        raise ValueError("bad offset")
+    return state
+
+
+def int_arg(args: dict, name: str, default: int, low: int, high: int) -> int:
+    """Integer tool argument (numeric strings accepted), clamped to low…high."""
+    value = args.get(name, default)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {args[name]!r}") from None
+    return max(low, min(value, high))
+
+
+def str_arg(args: dict, name: str, default: str | None = None) -> str | None:
+    value = args.get(name, default)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"{name} must be a string")
+    return value
+
+
+def bool_arg(args: dict, name: str, default: bool) -> bool:
+    value = args.get(name, default)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+class LexicalIndex:
+    """TF-IDF keyword index over chunk texts, the fallback when embeddings are unavailable."""
+
+    def __init__(self, metadata: list[dict]):
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+        self.norms = []
+        for row, meta in enumerate(metadata):
+            counts = Counter(re.findall(r"\w+", meta.get("text", "").lower()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((row, tf))
+            self.norms.append(math.sqrt(sum(counts.values())) or 1.0)
+        self.n = len(metadata)
+
+    def search(self, query: str, top_k: int) -> list[tuple[float, int]]:
+        """(score, row) pairs, best first, scores scaled to 0…1."""
+        scores: dict[int, float] = {}
+        for term in set(re.findall(r"\w+", query.lower())):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + self.n / len(postings))
+            for row, tf in postings:
+                scores[row] = scores.get(row, 0.0) + tf * idf / self.norms[row]
+        best = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:top_k]
+        top = best[0][1] if best else 1.0
+        return [(score / top, row) for row, score in best]
+
+
+def mmr_select(relevance, vectors, sources: list[str], k: int,
+               lam: float = MMR_LAMBDA, cap: int = PER_SOURCE_CAP) -> list[int]:
+    """Greedy Maximal Marginal Relevance over candidates, at most `cap` per source.
+
+    `relevance` holds the candidates' query similarities, `vectors` their
+    normalised embeddings (None: rank by relevance, only apply the cap).
+    Returns candidate positions in selection order. One matrix-vector product
+    per pick, so a few dozen candidates cost well under a millisecond.
+    """
+    import numpy as np
+    relevance = np.asarray(relevance, dtype="float32")
+    source_ids = {}
+    source_of = np.array([source_ids.setdefault(s, len(source_ids)) for s in sources])
+    per_source = [0] * len(source_ids)
+    available = np.ones(len(relevance), dtype=bool)
+    redundancy = np.zeros(len(relevance), dtype="float32")  # max similarity to a picked candidate
+    picked = []
+    while len(picked) < k and available.any():
+        score = lam * relevance - (1 - lam) * redundancy if vectors is not None else relevance.copy()
+        score[~available] = -np.inf
+        j = int(score.argmax())
+        picked.append(j)
+        available[j] = False
+        src = source_of[j]
+        per_source[src] += 1
+        if cap and per_source[src] >= cap:
+            available[source_of == src] = False
+        if vectors is not None:
+            np.maximum(redundancy, vectors @ vectors[j], out=redundancy)
+    return picked
+
+
+class QueryCache:
+    """Recent query embeddings → their FAISS hits, matched by cosine similarity.
+
+    The ANN index over cached queries is a preallocated matrix of at most `size`
+    normalised vectors, scanned with one matrix-vector product: exact, and well
+    under a millisecond at this size. Slots are reused least-recently-used first.
+    Scores of a reused hit list are those of the cached query, not the new one.
+    """
+
+    def __init__(self, dim: int, size: int = QUERY_CACHE_SIZE, threshold: float = QUERY_CACHE_THRESHOLD):
+        import numpy as np
+        self.threshold = threshold
+        self.vectors = np.zeros((size, dim), dtype="float32")
+        self.hits = [None] * size  # (distances, indices) rows per slot
+        self.lru = OrderedDict()  # slot → None, least recently used first
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.lru)
+
+    def lookup(self, query_vec):
+        """(slot, cached vector, distances, indices) of the nearest cached query, or None."""
+        with self.lock:
+            used = len(self.lru)
+            if not used:
+                return None
+            sims = self.vectors[:used] @ query_vec
+            slot = int(sims.argmax())
+            if sims[slot] < self.threshold:
+                return None
+            self.lru.move_to_end(slot)
+            distances, indices = self.hits[slot]
+            return slot, self.vectors[slot].copy(), distances, indices
+
+    def store(self, query_vec, distances, indices, slot: int | None = None):
+        """Cache hits for `query_vec`, replacing `slot` if it still holds that query."""
+        with self.lock:
+            if slot is None or not (self.vectors[slot] == query_vec).all():
+                if len(self.lru) < len(self.hits):
+                    slot = len(self.lru)
+                else:
+                    slot, _ = self.lru.popitem(last=False)
+            self.vectors[slot] = query_vec
+            self.hits[slot] = (distances, indices)
+            self.lru[slot] = None
+            self.lru.move_to_end(slot)
+
+
+class Collection:
+    """One named corpus: FAISS index + chunk metadata + embedder identity, loaded on demand."""
+
+    def __init__(self, name: str, spec: dict):
+        self.name = name
+        self.description = spec.get("description", "")
+        prefix = spec.get("prefix", name)
+        self.index_path = VECTORDB_DIR / f"{prefix}.faiss"
+        self.meta_path = VECTORDB_DIR / f"{prefix}_metadata.json"
+        self.info_path = VECTORDB_DIR / f"{prefix}_index_info.json"
+        self.vectors_path = VECTORDB_DIR / f"{prefix}_vectors.json"
+        self.spec_sections = spec.get("sections") or []
+        self.lock = threading.Lock()
+        self.last_used = 0.0
+        self.read_info()
+        self._reset()
+
+    def read_info(self):
+        """(Re)read <name>_index_info.json: embedder identity and sections.
+
+        A malformed file only marks this collection broken (`info_error`).
+        """
+        self.info = {}
+        self.info_error = None
+        if self.info_path.exists():
+            try:
+                with open(self.info_path) as f:
+                    info = json.load(f)
+                if not isinstance(info, dict):
+                    raise ValueError("not a JSON object")
+                self.info = info
+            except (OSError, ValueError) as e:
+                self.info_error = f"cannot read {self.info_path.name}: {e}"
+                sys.stderr.write(f"❌ [{self.name}] {self.info_error}\n")
+        self.sections = self.info.get("sections") or self.spec_sections
+
+    def disk_stamp(self) -> tuple:
+        """Size and mtime of the collection's files, to notice a rebuilt index."""
+        stamp = []
+        for path in (self.index_path, self.meta_path, self.info_path, self.vectors_path):
+            try:
+                st = path.stat()
+                stamp.append((st.st_size, st.st_mtime_ns))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def _reset(self):
+        self.loaded = False
+        self.embedder = None
         self.index = None
         self.metadata = None
-        self._load_index()
+        self.metadata_bytes = 0
+        self.chunk_rows = {}
+        self.index_error = None
+        self.lexical = None
+        self.query_cache = None
+        self.loaded_stamp = None
+
+    def exists(self) -> bool:
+        return self.index_path.exists() or self.vectors_path.exists()
 
-    def _load_index(self):
-        """Load FAISS index and metadata."""
-        if not INDEX_PATH.exists():
+    def estimated_bytes(self) -> int:
+        """Resident size once loaded: vectors + chunk texts (Python strings ≈ 2× their JSON size)."""
+        if self.loaded:
+            vectors = self.index.ntotal * self.index.d * 4 if self.index is not None else 0
+            if self.query_cache is not None:
+                vectors += self.query_cache.vectors.nbytes
+            return vectors + 2 * self.metadata_bytes
+        size = 0
+        for path in (self.index_path, self.meta_path, self.vectors_path):
+            if path.exists():
+                size += path.stat().st_size * (2 if path.suffix == ".json" else 1)
+        return size
+
+    def load(self):
+        """Load FAISS index and metadata; a failed load leaves the collection unloaded."""
+        try:
+            self._load()
+        except Exception:
+            self._reset()
+            raise
+
+    def _load(self):
+        self.loaded_stamp = self.disk_stamp()
+        if not self.index_path.exists():
             # Try fallback to JSON vectors
-            json_path = VECTORDB_DIR / "docs_vectors.json"
-            if json_path.exists():
-                sys.stderr.write(f"📦 Loading raw vectors from {json_path}\n")
-                with open(json_path) as f:
+            if self.vectors_path.exists():
+                sys.stderr.write(f"📦 Loading raw vectors from {self.vectors_path}\n")
+                with open(self.vectors_path) as f:
                     data = json.load(f)
-                self.metadata = [{"source": d["source"], "text": d["text"], "section": d["section"]} for d in data]
-                # Build in-memory FAISS index
-                try:
-                    import faiss
-                    import numpy as np
-                    embeddings = np.array([d["embedding"] for d in data], dtype="float32")
-                    faiss.normalize_L2(embeddings)
-                    dim = embeddings.shape[1]
-                    self.index = faiss.IndexFlatIP(dim)
-                    self.index.add(embeddings)
-                    sys.stderr.write(f"✅ Built FAISS index from JSON: {len(data)} vectors\n")
-                except ImportError:
-                    sys.stderr.write("⚠ FAISS not available, using brute-force search\n")
-                    self._raw_vectors = data
-                return
-            sys.stderr.write(f"⚠ No index found at {INDEX_PATH}\n")
+                self.metadata = [{k: v for k, v in d.items() if k != "embedding"} for d in data]
+                import faiss
+                import numpy as np
+                embeddings = np.array([d["embedding"] for d in data], dtype="float32")
+                faiss.normalize_L2(embeddings)
+                self.index = faiss.IndexFlatIP(embeddings.shape[1])
+                self.index.add(embeddings)
+                sys.stderr.write(f"✅ [{self.name}] Built FAISS index from JSON: {len(data)} vectors\n")
+            else:
+                sys.stderr.write(f"⚠ No index found at {self.index_path}\n")
+        else:
+            import faiss
+            try:
+                self.index = faiss.read_index(str(self.index_path))
+            except Exception as e:
+                sys.stderr.write(f"❌ [{self.name}] Failed to load FAISS index: {e}\n")
+                raise RuntimeError(f"cannot read {self.index_path.name}: {e}") from e
+            sys.stderr.write(f"✅ [{self.name}] FAISS index loaded: {self.index.ntotal} vectors\n")
+
+            if self.meta_path.exists():
+                with open(self.meta_path) as f:
+                    self.metadata = json.load(f)
+                sys.stderr.write(f"✅ [{self.name}] Metadata loaded: {len(self.metadata)} entries\n")
+
+        self._link_chunks()
+        if self.index is not None:
+            import faiss
+            # reconstruct() (diversification) needs the IVF direct map; build it before
+            # the collection is published, never while other threads search it
+            ivf = faiss.try_extract_index_ivf(self.index)
+            if ivf is not None:
+                ivf.make_direct_map()
+        if self.index is not None and QUERY_CACHE_SIZE > 0:
+            self.query_cache = QueryCache(self.index.d)
+        self.loaded = True
+
+    def unload(self):
+        sys.stderr.write(f"♻ [{self.name}] Unloaded ({self.estimated_bytes() // 2**20}MB)\n")
+        self._reset()
+
+    def _link_chunks(self):
+        """Index chunk IDs → rows; derive IDs/neighbours for metadata built before they existed."""
+        if not self.metadata:
+            return
+        self.metadata_bytes = sum(len(m.get("text", "")) for m in self.metadata)
+        if all("id" in m for m in self.metadata):
+            self.chunk_rows = {m["id"]: row for row, m in enumerate(self.metadata)}
             return
 
+        # Legacy metadata: rows of one source are contiguous and in document order
+        previous = None
+        ordinal = 0
+        for row, m in enumerate(self.metadata):
+            same_source = previous is not None and previous.get("source") == m.get("source")
+            ordinal = ordinal + 1 if same_source else 0
+            m["id"] = f"{m.get('source', 'unknown')}#{ordinal}"
+            m["prev"] = previous["id"] if same_source else None
+            m["next"] = None
+            if same_source:
+                previous["next"] = m["id"]
+            self.chunk_rows[m["id"]] = row
+            previous = m
+
+    def reconstruct(self, index, rows):
+        """Stored (normalised) vectors of index rows (IVF direct maps are built in load)."""
+        import numpy as np
+        return index.reconstruct_batch(np.asarray(rows, dtype="int64"))
+
+    def attach_embedder(self, embedder):
+        """Set the query embedder, checking it matches the one that built the index."""
+        self._check_index_info(embedder)
+        self.embedder = embedder
+
+    def _check_index_info(self, embedder):
+        """Refuse to query an index whose vectors came from another backend/model."""
+        if not self.info:
+            sys.stderr.write(f"⚠ No {self.info_path.name}; cannot verify the index embedder\n")
+            return
+        info = dict(self.info)
+        if self.index is not None and info.get("dim") is None:
+            info["dim"] = self.index.d
+        self.index_error = incompatibility(info, embedder)
+        if self.index_error:
+            sys.stderr.write(f"❌ [{self.name}] Embedder mismatch: {self.index_error}\n")
+
+
+def discover_collections() -> tuple[dict[str, Collection], str]:
+    """Collections from vectordb/collections.json, or the single legacy `docs` index."""
+    specs = None
+    if MANIFEST_PATH.exists():
         try:
-            import faiss
-            self.index = faiss.read_index(str(INDEX_PATH))
-            sys.stderr.write(f"✅ FAISS index loaded: {self.index.ntotal} vectors\n")
+            with open(MANIFEST_PATH) as f:
+                manifest = json.load(f)
+            specs = manifest["collections"]
+            if not isinstance(specs, dict):
+                raise ValueError("'collections' is not an object")
+            default = manifest.get("default") or next(iter(specs), DEFAULT_COLLECTION)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            sys.stderr.write(f"❌ Cannot read {MANIFEST_PATH}: {e}; serving only '{DEFAULT_COLLECTION}'\n")
+            specs = None
+    if specs is None:
+        specs = {DEFAULT_COLLECTION: {"description": "OpenCode, OpenClaw and Oh My OpenCode documentation"}}
+        default = DEFAULT_COLLECTION
+    collections = {name: Collection(name, spec if isinstance(spec, dict) else {})
+                   for name, spec in specs.items()}
+    return collections, default
+
+
+# JSON-RPC methods counted under their own label; anything else is "unknown"
+KNOWN_METHODS = {"initialize", "tools/list", "tools/call", "notifications/initialized", "ping"}
+
+
+class VectorSearchServer:
+    def __init__(self):
+        self.collections, self.default_collection = discover_collections()
+        self.memory_budget = int(MEMORY_BUDGET_MB * 2**20)
+        self.embedders = {}
+        self._embed_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._registry_lock = threading.Lock()
+        METRICS.add_gauges(self._index_gauges)
+        METRICS.add_gauges(self._embedder_gauges)
+
+        preload = [n.strip() for n in SEARCH_PRELOAD.split(",") if n.strip()] if SEARCH_PRELOAD else [self.default_collection]
+        for name in preload:
+            if name in self.collections and self.collections[name].exists():
+                try:
+                    coll = self.collection(name)
+                    embedder = self.query_embedder(coll)
+                except Exception as e:
+                    METRICS.inc("errors", "collection_load")
+                    sys.stderr.write(f"⚠ [{name}] Preload failed: {e}\n")
+                    continue
+                if EMBED_WARMUP and coll.index is not None and not coll.index_error:
+                    threading.Thread(target=self._warmup, args=(embedder,),
+                                     name="embed-warmup", daemon=True).start()
+
+    def _warmup(self, embedder):
+        """Get the embedding model resident before the first agent query."""
+        try:
+            seconds = embedder.warmup()
+            sys.stderr.write(f"🔥 Embedder {embedder.describe()} warm ({seconds:.1f}s)\n")
         except Exception as e:
-            sys.stderr.write(f"❌ Failed to load FAISS index: {e}\n")
+            METRICS.inc("errors", "warmup")
+            sys.stderr.write(f"⚠ Embedder warmup failed: {e}\n")
+
+    def _index_gauges(self) -> dict:
+        """Index size and approximate memory footprint for server_stats."""
+        loaded = [c for c in self.collections.values() if c.loaded]
+        return {
+            "collections_total": len(self.collections),
+            "collections_loaded": len(loaded),
+            "collections_bytes": sum(c.estimated_bytes() for c in loaded),
+            "memory_budget_bytes": self.memory_budget,
+            "index_vectors": sum(c.index.ntotal for c in loaded if c.index is not None),
+            "metadata_entries": sum(len(c.metadata or []) for c in loaded),
+            "metadata_bytes": sum(c.metadata_bytes for c in loaded),
+            "query_cache_entries": sum(len(c.query_cache) for c in loaded if c.query_cache is not None),
+        }
+
+    def _embedder_gauges(self) -> dict:
+        gauges = {}
+        for embedder in list(self.embedders.values()):
+            gauges.update(embedder.stats())
+        return gauges
+
+    def embedder_for(self, coll: Collection):
+        """Shared embedder for the backend/model a collection was built with (env default otherwise)."""
+        key = (coll.info.get("backend"), coll.info.get("model"))
+        with self._registry_lock:
+            embedder = self.embedders.get(key)
+            if embedder is None:
+                embedder = self.embedders[key] = get_embedder(*key)
+            return embedder
+
+    def query_embedder(self, coll: Collection):
+        """The collection's embedder, built on first search (get_chunks never needs it)."""
+        embedder = coll.embedder
+        if embedder is None:
+            embedder = self.embedder_for(coll)
+            coll.attach_embedder(embedder)
+        return embedder
+
+    def collection(self, name: str | None = None) -> Collection:
+        """A loaded collection, loading it (and evicting LRU ones over budget) if needed."""
+        name = name or self.default_collection
+        coll = self.collections.get(name)
+        if coll is None:
+            raise KeyError(f"Unknown collection {name!r}; available: {', '.join(self.collections)}")
+        with coll.lock:
+            # A long-lived daemon picks up indexes rebuilt by vectorize_docs.py
+            if coll.loaded and coll.disk_stamp() != coll.loaded_stamp:
+                sys.stderr.write(f"🔄 [{name}] Index files changed on disk, reloading\n")
+                coll.unload()
+                METRICS.inc("collection_reloads", name)
+            if not coll.loaded:
+                coll.read_info()  # may have been fixed since the last attempt
+                if coll.info_error:
+                    raise RuntimeError(coll.info_error)
+                self._make_room(coll)
+                with METRICS.timer("collection_load"):
+                    coll.load()
+                METRICS.inc("collection_loads", name)
+            coll.last_used = time.monotonic()
+        return coll
+
+    def _make_room(self, incoming: Collection):
+        """Unload least-recently-used collections until `incoming` fits the memory budget."""
+        if self.memory_budget <= 0:
             return
+        needed = incoming.estimated_bytes()
+        with self._registry_lock:
+            loaded = sorted((c for c in self.collections.values() if c.loaded and c is not incoming),
+                            key=lambda c: c.last_used)
+            used = sum(c.estimated_bytes() for c in loaded)
+            for victim in loaded:
+                if used + needed <= self.memory_budget:
+                    break
+                # Skip collections busy loading; in-flight searches keep their own references
+                if not victim.lock.acquire(blocking=False):
+                    continue
+                try:
+                    used -= victim.estimated_bytes()
+                    victim.unload()
+                    METRICS.inc("collection_evictions", victim.name)
+                finally:
+                    victim.lock.release()
 
-        if META_PATH.exists():
-            with open(META_PATH) as f:
-                self.metadata = json.load(f)
-            sys.stderr.write(f"✅ Metadata loaded: {len(self.metadata)} entries\n")
+    def qualify(self, coll: Collection, chunk_id: str | None) -> str | None:
+        """Chunk IDs outside the default collection carry a `collection:` prefix."""
+        if chunk_id is None or coll.name == self.default_collection:
+            return chunk_id
+        return f"{coll.name}:{chunk_id}"
 
-    def search(self, query: str, top_k: int = TOP_K) -> list[dict]:
-        """Search the vector index."""
-        if self.index is None and not hasattr(self, '_raw_vectors'):
-            return [{"error": "No index loaded. Run vectorize_docs.py first."}]
+    def resolve(self, qualified_id: str) -> tuple[str, str]:
+        """(collection name, chunk ID) for an ID from search results."""
+        name, sep, chunk_id = qualified_id.partition(":")
+        if sep and name in self.collections:
+            return name, chunk_id
+        return self.default_collection, qualified_id
+
+    def embed_query(self, query: str, embedder) -> list[float]:
+        """Embed a query, reusing recent embeddings of identical queries."""
+        key = (embedder.backend, embedder.model, query)
+        with self._cache_lock:
+            cached = self._embed_cache.get(key)
+            if cached is not None:
+                self._embed_cache.move_to_end(key)
+        METRICS.record_cache("embedding", cached is not None)
+        if cached is not None:
+            return cached
+        with METRICS.timer("embed"):
+            vector = embedder.embed_one(query)
+        if EMBED_CACHE_SIZE > 0:
+            with self._cache_lock:
+                self._embed_cache[key] = vector
+                if len(self._embed_cache) > EMBED_CACHE_SIZE:
+                    self._embed_cache.popitem(last=False)
+        return vector
+
+    def search(self, query: str, top_k: int = TOP_K, collection: str | None = None,
+               diversify: bool = False) -> list[dict]:
+        """Search the vector index of a collection (the default one if not given).
+
+        With `diversify`, over-fetched hits are re-ranked by MMR and capped per source.
+        """
+        try:
+            coll = self.collection(collection)
+        except KeyError as e:
+            return [{"error": e.args[0]}]
+        except Exception as e:
+            METRICS.inc("errors", "collection_load")
+            return [{"error": f"Cannot load collection {collection or self.default_collection!r}: {e}"}]
+        try:
+            embedder = self.query_embedder(coll)
+        except Exception as e:
+            METRICS.inc("errors", "embedder")
+            if SEARCH_FALLBACK != "lexical" or not coll.metadata:
+                return [{"error": f"Cannot create embedder for {coll.name}: {e}"}]
+            return self.lexical_search(coll, query, top_k, reason=str(e))
+        if coll.index_error:
+            return [{"error": f"Embedder mismatch: {coll.index_error}"}]
+        # Local references: an eviction must not pull the index out from under this search
+        index, metadata, query_cache = coll.index, coll.metadata, coll.query_cache
+        if index is None:
+            return [{"error": f"No index loaded for {coll.name}. Run vectorize_docs.py first."}]
 
         try:
             import faiss
             import numpy as np
 
-            query_vec = np.array([get_embedding(query)], dtype="float32")
+            try:
+                query_vec = np.array([self.embed_query(query, embedder)], dtype="float32")
+            except Exception as e:
+                METRICS.inc("errors", "embed")
+                if SEARCH_FALLBACK != "lexical" or not metadata:
+                    raise
+                return self.lexical_search(coll, query, top_k, reason=str(e))
             faiss.normalize_L2(query_vec)
 
-            distances, indices = self.index.search(query_vec, top_k)
+            fetch = top_k * max(1, CANDIDATES) if diversify else top_k
+            distances, indices = self.search_index(index, query_cache, query_vec, fetch)
+            hits = [(float(dist), int(idx)) for dist, idx in zip(distances[0], indices[0]) if idx != -1]
+            if diversify and hits:
+                hits = self.diversify(coll, index, metadata, hits, top_k)
+
+            with METRICS.timer("lookup"):
+                results = []
+                for i, (dist, idx) in enumerate(hits):
+                    meta = metadata[idx] if metadata and idx < len(metadata) else {}
+                    results.append({
+                        "rank": i + 1,
+                        "score": dist,
+                        "id": self.qualify(coll, meta.get("id")),
+                        "source": meta.get("source", "unknown"),
+                        "section": meta.get("section", "unknown"),
+                        "text": meta.get("text", ""),
+                    })
+            return results
+
+        except Exception as e:
+            METRICS.inc("errors", "search")
+            return [{"error": str(e)}]
+
+    def search_index(self, index, query_cache, query_vec, top_k: int):
+        """FAISS search, reusing the hits of a near-duplicate recent query when deep enough."""
+        if query_cache is None:
+            with METRICS.timer("search"):
+                return index.search(query_vec, top_k)
+        with METRICS.timer("query_cache"):
+            match = query_cache.lookup(query_vec[0])
+        if match is not None and len(match[3]) >= top_k:
+            METRICS.record_cache("query", True)
+            _, _, distances, indices = match
+            return distances[None, :top_k], indices[None, :top_k]
+        METRICS.record_cache("query", False)
+        slot = None
+        if match is not None:
+            # Deeper page of a cached query: extend its hits so pages stay consistent
+            slot, cached_vec = match[0], match[1]
+            query_vec = cached_vec[None, :]
+        with METRICS.timer("search"):
+            distances, indices = index.search(query_vec, top_k)
+        query_cache.store(query_vec[0], distances[0], indices[0], slot)
+        return distances, indices
 
-            results = []
-            for i, (dist, idx) in enumerate(zip(distances[0], indices[0])):
-                if idx == -1:
+    def diversify(self, coll: Collection, index, metadata: list[dict] | None,
+                  hits: list[tuple[float, int]], top_k: int) -> list[tuple[float, int]]:
+        """Pick `top_k` of the (score, row) hits by MMR with a per-source cap.
+
+        `index` and `metadata` are the caller's snapshot, so a concurrent reload
+        cannot mix rows of the old index with sources of the new one.
+        """
+        metadata = metadata or []
+        rows = [idx for _, idx in hits]
+        sources = [metadata[idx].get("source", "unknown") if idx < len(metadata) else "unknown"
+                   for idx in rows]
+        vectors = None
+        if MMR_LAMBDA < 1:
+            try:
+                with METRICS.timer("reconstruct"):
+                    vectors = coll.reconstruct(index, rows)
+            except Exception as e:
+                METRICS.inc("errors", "reconstruct")
+                sys.stderr.write(f"⚠ [{coll.name}] Cannot reconstruct vectors, capping per source only: {e}\n")
+        with METRICS.timer("diversify"):
+            picked = mmr_select([score for score, _ in hits], vectors, sources, top_k)
+        return [hits[j] for j in picked]
+
+    def lexical_search(self, coll: Collection, query: str, top_k: int, reason: str) -> list[dict]:
+        """Keyword results, used when the query cannot be embedded."""
+        METRICS.inc("fallbacks", "lexical")
+        metadata, lexical = coll.metadata, coll.lexical
+        if lexical is None:
+            # Built on first use; a concurrent duplicate build is harmless
+            with METRICS.timer("lexical_build"):
+                lexical = coll.lexical = LexicalIndex(metadata)
+        with METRICS.timer("lexical"):
+            hits = lexical.search(query, top_k)
+        results = []
+        for rank, (score, row) in enumerate(hits, 1):
+            meta = metadata[row]
+            results.append({
+                "rank": rank,
+                "score": score,
+                "id": self.qualify(coll, meta.get("id")),
+                "source": meta.get("source", "unknown"),
+                "section": meta.get("section", "unknown"),
+                "text": meta.get("text", ""),
+                "fallback": reason,
+            })
+        return results
+
+    def search_page(self, query: str, top_k: int = TOP_K, offset: int = 0,
+                    section: str | None = None, collection: str | None = None,
+                    diversify: bool = False) -> tuple[list[dict], bool]:
+        """One page of results (ranks offset+1 … offset+top_k) and whether more follow."""
+        want = offset + top_k
+        # Over-fetch when filtering by section; one extra hit tells us if there is a next page
+        fetch = min(MAX_DEPTH, want * 2 if section else want) + 1
+        results = self.search(query, top_k=fetch, collection=collection, diversify=diversify)
+        if results and "error" in results[0]:
+            return results, False
+        if section:
+            results = [r for r in results if r.get("section") == section]
+        if not diversify:
+            # Break score ties by chunk ID so pages stay consistent across fetch depths
+            results.sort(key=lambda r: (-r["score"], r["id"] or ""))
+        for rank, r in enumerate(results, 1):
+            r["rank"] = rank
+        has_more = len(results) > want and want < MAX_DEPTH
+        return results[offset:want], has_more
+
+    def get_chunks(self, ids: list[str], neighbors: int = 0) -> list[dict]:
+        """Full chunks by ID, each preceded/followed by up to `neighbors` adjacent chunks."""
+        neighbors = max(0, min(neighbors, MAX_NEIGHBORS))
+        chunks = []
+        seen = set()
+        for qualified_id in ids:
+            name, chunk_id = self.resolve(qualified_id)
+            try:
+                coll = self.collection(name)
+            except Exception as e:
+                METRICS.inc("errors", "collection_load")
+                chunks.append({"id": qualified_id, "error": f"cannot load collection {name!r}: {e}"})
+                continue
+            metadata, chunk_rows = coll.metadata, coll.chunk_rows
+            row = chunk_rows.get(chunk_id)
+            if row is None:
+                chunks.append({"id": qualified_id, "error": "unknown chunk id"})
+                continue
+            before = []
+            meta = metadata[row]
+            for _ in range(neighbors):
+                if meta.get("prev") is None:
+                    break
+                meta = metadata[chunk_rows[meta["prev"]]]
+                before.append(meta)
+            after = []
+            meta = metadata[row]
+            for _ in range(neighbors):
+                if meta.get("next") is None:
+                    break
+                meta = metadata[chunk_rows[meta["next"]]]
+                after.append(meta)
+            for meta in [*reversed(before), metadata[row], *after]:
+                full_id = self.qualify(coll, meta["id"])
+                if full_id in seen:
                     continue
-                meta = self.metadata[idx] if self.metadata and idx < len(self.metadata) else {}
-                results.append({
-                    "rank": i + 1,
-                    "score": float(dist),
+                seen.add(full_id)
+                chunks.append({
+                    "id": full_id,
                     "source": meta.get("source", "unknown"),
                     "section": meta.get("section", "unknown"),
-                    "text": meta.get("text", "")[:500],  # Truncate for MCP
+                    "requested": meta["id"] == chunk_id,
+                    "prev": self.qualify(coll, meta.get("prev")),
+                    "next": self.qualify(coll, meta.get("next")),
+                    "text": meta.get("text", ""),
                 })
-            return results
+        return chunks
 
-        except Exception as e:
-            return [{"error": str(e)}]
+    def describe_collections(self) -> str:
+        return "; ".join(
+            f"{c.name}{' (default)' if c.name == self.default_collection else ''}"
+            f"{' — ' + c.description if c.description else ''}"
+            for c in self.collections.values()
+        )
 
-    def handle_request(self, request: dict):
-        """Handle a JSON-RPC request."""
+    def handle_request(self, request: dict) -> dict | None:
+        """Handle a JSON-RPC request, returning the response (None for notifications)."""
         method = request.get("method", "")
         req_id = request.get("id")
-        params = request.get("params", {})
+        params = request.get("params") or {}
+        METRICS.inc("requests", method if method in KNOWN_METHODS else "unknown")
+        if not isinstance(params, dict):
+            return make_error(req_id, -32602, "params must be an object")
 
         if method == "initialize":
-            send_response(req_id, {
+            return make_response(req_id, {
                 "protocolVersion": "2024-11-05",
                 "capabilities": {"tools": {"listChanged": False}},
                 "serverInfo": {
@@ -154,13 +1130,18 @@ class VectorSearchServer:
             })
 
         elif method == "tools/list":
-            send_response(req_id, {
+            sections = sorted({s for c in self.collections.values() for s in c.sections})
+            section_schema = {"type": "string", "description": "Filter by section"}
+            if sections:
+                section_schema["description"] = f"Filter by section: {', '.join(sections)}"
+                section_schema["enum"] = sections
+            return make_response(req_id, {
                 "tools": [
                     {
                         "name": "search_docs",
                         "description": (
                             "Search Lena's documentation knowledge base. "
-                            "Covers OpenCode, OpenClaw, and Oh My OpenCode documentation. "
+                            f"Collections: {self.describe_collections()}. "
                             "Returns the most relevant documentation snippets for your query."
                         ),
                         "inputSchema": {
@@ -175,106 +1156,445 @@ class VectorSearchServer:
                                     "description": "Number of results to return (default: 5)",
                                     "default": 5,
                                 },
-                                "section": {
+                                "collection": {
+                                    "type": "string",
+                                    "description": f"Collection to search (default: {self.default_collection})",
+                                    "enum": list(self.collections),
+                                    "default": self.default_collection,
+                                },
+                                "section": section_schema,
+                                "diversify": {
+                                    "type": "boolean",
+                                    "description": (
+                                        "Prefer distinct content: drop near-duplicate chunks and keep at "
+                                        f"most {PER_SOURCE_CAP or 'any number of'} results per source"
+                                    ),
+                                    "default": DIVERSIFY,
+                                },
+                                "cursor": {
                                     "type": "string",
-                                    "description": "Filter by section: opencode, openclaw, or oh-my-opencode",
-                                    "enum": ["opencode", "openclaw", "oh-my-opencode"],
+                                    "description": (
+                                        "next_cursor from a previous search_docs call, to fetch the "
+                                        "next page of results for the same query"
+                                    ),
                                 },
                             },
-                            "required": ["query"],
                         },
-                    }
+                    },
+                    {
+                        "name": "get_chunks",
+                        "description": (
+                            "Fetch the full text of documentation chunks by the IDs returned from "
+                            "search_docs, optionally with neighbouring chunks for surrounding context. "
+                            "Cheaper than a new search when a snippet was cut off."
+                        ),
+                        "inputSchema": {
+                            "type": "object",
+                            "properties": {
+                                "ids": {
+                                    "type": "array",
+                                    "items": {"type": "string"},
+                                    "description": "Chunk IDs from search_docs results",
+                                },
+                                "neighbors": {
+                                    "type": "integer",
+                                    "description": f"Adjacent chunks to include on each side (0-{MAX_NEIGHBORS}, default: 0)",
+                                    "default": 0,
+                                },
+                            },
+                            "required": ["ids"],
+                        },
+                    },
+                    {
+                        "name": "server_stats",
+                        "description": (
+                            "Runtime statistics of the docs search server: per-stage latency "
+                            "histograms (embed, search, lookup, format, write — socket_write in the "
+                            "shared daemon, whose `proxy` section then holds this session's stdout "
+                            "write and daemon round-trip timings), request and "
+                            "error counts, cache hit rates, index size and memory."
+                        ),
+                        "inputSchema": {"type": "object", "properties": {}},
+                    },
                 ]
             })
 
         elif method == "tools/call":
             tool_name = params.get("name", "")
-            args = params.get("arguments", {})
+            args = params.get("arguments") or {}
+            if not isinstance(args, dict):
+                return make_error(req_id, -32602, "arguments must be an object")
 
             if tool_name == "search_docs":
-                query = args.get("query", "")
-                top_k = args.get("top_k", TOP_K)
-                section_filter = args.get("section")
+                METRICS.inc("tool_calls", tool_name)
+                offset = 0
+                if args.get("cursor"):
+                    try:
+                        args = {**args, **decode_cursor(args["cursor"])}
+                        offset = min(args["offset"], MAX_DEPTH)
+                    except (ValueError, KeyError, TypeError, AttributeError) as e:
+                        return make_error(req_id, -32602, f"Invalid cursor: {e}")
+                try:
+                    query = str_arg(args, "query", "")
+                    top_k = int_arg(args, "top_k", TOP_K, 1, MAX_DEPTH)
+                    section_filter = str_arg(args, "section")
+                    collection = str_arg(args, "collection")
+                    diversify = bool_arg(args, "diversify", DIVERSIFY)
+                except ValueError as e:
+                    return make_error(req_id, -32602, f"Invalid arguments: {e}")
+                if not query:
+                    return make_error(req_id, -32602, "search_docs needs a query or a cursor")
 
-                results = self.search(query, top_k=top_k * 2 if section_filter else top_k)
+                with METRICS.timer("request"):
+                    results, has_more = self.search_page(query, top_k, offset, section_filter, collection,
+                                                         diversify)
 
-                # Apply section filter
-                if section_filter:
-                    results = [r for r in results if r.get("section") == section_filter][:top_k]
+                    with METRICS.timer("format"):
+                        text_output = f"## 📚 Search Results for: \"{query}\"\n\n"
+                        if results and "fallback" in results[0]:
+                            text_output += (
+                                f"⚠ Semantic search unavailable ({results[0]['fallback'][:120]}); "
+                                f"showing keyword matches.\n\n"
+                            )
+                        for r in results:
+                            if "error" in r:
+                                text_output += f"❌ Error: {r['error']}\n"
+                            else:
+                                text_output += f"### [{r['rank']}] {r['source']} (score: {r['score']:.3f}, id: {r['id']})\n"
+                                text_output += f"{r['text'][:SNIPPET_CHARS]}"
+                                if len(r["text"]) > SNIPPET_CHARS:
+                                    text_output += f"… [+{len(r['text']) - SNIPPET_CHARS} chars, get_chunks]"
+                                text_output += "\n\n---\n\n"
+                        if has_more:
+                            cursor = encode_cursor(query, top_k, offset + top_k, section_filter, collection,
+                                                   diversify)
+                            text_output += f"next_cursor: {cursor}\n"
 
-                text_output = f"## 📚 Search Results for: \"{query}\"\n\n"
-                for r in results:
-                    if "error" in r:
-                        text_output += f"❌ Error: {r['error']}\n"
-                    else:
-                        text_output += f"### [{r['rank']}] {r['source']} (score: {r['score']:.3f})\n"
-                        text_output += f"{r['text']}\n\n---\n\n"
+                return make_response(req_id, {
+                    "content": [{"type": "text", "text": text_output}],
+                    "isError": False,
+                })
+            elif tool_name == "get_chunks":
+                METRICS.inc("tool_calls", tool_name)
+                ids = args.get("ids", [])
+                if isinstance(ids, str):
+                    ids = [ids]
+                if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+                    return make_error(req_id, -32602, "Invalid arguments: ids must be a list of chunk ID strings")
+                try:
+                    neighbors = int_arg(args, "neighbors", 0, 0, MAX_NEIGHBORS)
+                except ValueError as e:
+                    return make_error(req_id, -32602, f"Invalid arguments: {e}")
+                with METRICS.timer("get_chunks"):
+                    chunks = self.get_chunks(ids, neighbors)
+                    text_output = ""
+                    for c in chunks:
+                        if "error" in c:
+                            text_output += f"❌ {c['id']}: {c['error']}\n\n"
+                            continue
+                        marker = "" if c["requested"] else " (neighbour)"
+                        text_output += f"### {c['id']}{marker} — {c['source']}\n"
+                        text_output += f"prev: {c['prev'] or '-'} | next: {c['next'] or '-'}\n\n"
+                        text_output += f"{c['text']}\n\n---\n\n"
 
-                send_response(req_id, {
+                return make_response(req_id, {
                     "content": [{"type": "text", "text": text_output}],
                     "isError": False,
                 })
+            elif tool_name == "server_stats":
+                METRICS.inc("tool_calls", tool_name)
+                return make_response(req_id, {
+                    "content": [{"type": "text", "text": json.dumps(METRICS.snapshot(), indent=2)}],
+                    "isError": False,
+                })
             else:
-                send_error(req_id, -32601, f"Unknown tool: {tool_name}")
+                return make_error(req_id, -32601, f"Unknown tool: {tool_name}")
 
         elif method == "notifications/initialized":
-            pass  # No response needed for notifications
+            return None  # No response needed for notifications
 
         elif method == "ping":
-            send_response(req_id, {})
+            return make_response(req_id, {})
 
         else:
             if req_id is not None:
-                send_error(req_id, -32601, f"Method not found: {method}")
+                return make_error(req_id, -32601, f"Method not found: {method}")
 
     def run(self):
         """Run the MCP server on stdio."""
         sys.stderr.write("🦞 Lena Docs Search MCP Server starting...\n")
-        sys.stderr.write(f"📁 Index: {INDEX_PATH}\n")
-        sys.stderr.write(f"🤖 Model: {EMBED_MODEL}\n")
+        sys.stderr.write(f"📁 Collections: {', '.join(self.collections)} in {VECTORDB_DIR}\n")
+        if STATS_EXPORT_PATH:
+            METRICS.start_exporter(STATS_EXPORT_PATH, STATS_EXPORT_INTERVAL)
 
-        buffer = ""
-        content_length = None
+        serve_stdio(self.handle_request)
 
-        while True:
-            try:
-                line = sys.stdin.readline()
-                if not line:
-                    break
 
-                buffer += line
+# ── Shared daemon ──────────────────────────────────────────────
+# Wire format on the Unix socket: one JSON-RPC message per line in each
+# direction; notifications are answered with `null`.
 
-                # Parse Content-Length header
-                if content_length is None:
-                    if buffer.startswith("Content-Length: "):
-                        content_length = int(buffer.split(":")[1].strip())
-                        buffer = ""
-                    elif buffer == "\r\n" or buffer == "\n":
-                        buffer = ""
-                    continue
+class _DaemonHandler(socketserver.StreamRequestHandler):
+    """Serve one proxy connection (one MCP session)."""
 
-                # Skip empty line after header
-                if buffer.strip() == "":
-                    buffer = ""
+    def handle(self):
+        self.server.connection_opened()
+        try:
+            for line in self.rfile:
+                if not line.strip():
                     continue
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as e:
+                    METRICS.inc("errors", "parse")
+                    response = make_error(None, -32700, f"Parse error: {e}")
+                else:
+                    response = handle_safely(self.server.search_server.handle_request, request)
+                with METRICS.timer("socket_write"):
+                    self.wfile.write(json.dumps(response).encode() + b"\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.server.connection_closed()
 
-                # Try to parse JSON body
-                if len(buffer.encode()) >= content_length:
-                    try:
-                        request = json.loads(buffer[:content_length])
-                        self.handle_request(request)
-                    except json.JSONDecodeError as e:
-                        sys.stderr.write(f"JSON parse error: {e}\n")
 
-                    buffer = ""
-                    content_length = None
+class SearchDaemon(socketserver.ThreadingUnixStreamServer):
+    """Unix-socket server sharing one VectorSearchServer across all sessions."""
 
-            except KeyboardInterrupt:
-                break
-            except Exception as e:
-                sys.stderr.write(f"Error: {e}\n")
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, search_server: VectorSearchServer):
+        self.search_server = search_server
+        self.active = 0
+        self.last_activity = time.monotonic()
+        self._conn_lock = threading.Lock()
+        super().__init__(socket_path, _DaemonHandler)
+        METRICS.add_gauges(lambda: {"daemon_connections": self.active})
+
+    def connection_opened(self):
+        with self._conn_lock:
+            self.active += 1
+
+    def connection_closed(self):
+        with self._conn_lock:
+            self.active -= 1
+            self.last_activity = time.monotonic()
+
+    def idle_for(self) -> float:
+        with self._conn_lock:
+            return 0.0 if self.active else time.monotonic() - self.last_activity
+
+
+def _private_dir(socket_path: str) -> Path:
+    """The socket's directory, created 0700; refuses one another user could write to."""
+    directory = Path(socket_path).parent
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o022:
+        raise PermissionError(f"{directory} must be a directory owned by you and not group/world-writable")
+    return directory
+
+
+def _check_socket_owner(socket_path: str):
+    """Refuse to talk to a socket that some other user created."""
+    st = os.lstat(socket_path)
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(f"{socket_path} is not a socket owned by you")
+
+
+def _open_private(path: str, flags: int):
+    """Open a file for writing without following symlinks, created 0600."""
+    fd = os.open(path, flags | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    return os.fdopen(fd, "ab" if flags & os.O_APPEND else "w")
+
+
+def _daemon_alive(socket_path: str) -> bool:
+    """True if a daemon of ours is accepting connections on `socket_path`."""
+    try:
+        _check_socket_owner(socket_path)
+    except OSError:
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def run_daemon(socket_path: str = DAEMON_SOCKET):
+    """Load the index once and serve it to every proxy on a Unix socket."""
+    _private_dir(socket_path)
+    if _daemon_alive(socket_path):
+        sys.stderr.write(f"⚠ Search daemon already running on {socket_path}\n")
+        return
+
+    # Load before binding, so proxies only ever connect to a warm daemon
+    search_server = VectorSearchServer()
+    Path(socket_path).unlink(missing_ok=True)
+    daemon = SearchDaemon(socket_path, search_server)
+    os.chmod(socket_path, 0o600)
+
+    sys.stderr.write("🦞 Lena Docs Search daemon starting...\n")
+    sys.stderr.write(f"🔌 Socket: {socket_path}\n")
+    sys.stderr.write(f"📁 Collections: {', '.join(search_server.collections)} in {VECTORDB_DIR}\n")
+    if STATS_EXPORT_PATH:
+        METRICS.start_exporter(STATS_EXPORT_PATH, STATS_EXPORT_INTERVAL)
+
+    # shutdown() blocks until serve_forever() returns, so never call it from the serving thread
+    def stop(*_):
+        threading.Thread(target=daemon.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    if DAEMON_IDLE_TIMEOUT > 0:
+        def watchdog():
+            while daemon.idle_for() < DAEMON_IDLE_TIMEOUT:
+                time.sleep(min(DAEMON_IDLE_TIMEOUT, 30))
+            sys.stderr.write(f"💤 Idle for {DAEMON_IDLE_TIMEOUT:g}s, shutting down\n")
+            daemon.shutdown()
+
+        threading.Thread(target=watchdog, name="idle-watchdog", daemon=True).start()
+
+    try:
+        daemon.serve_forever()
+    finally:
+        daemon.server_close()
+        Path(socket_path).unlink(missing_ok=True)
+        sys.stderr.write("🛑 Search daemon stopped\n")
+
+
+def ensure_daemon(socket_path: str = DAEMON_SOCKET) -> bool:
+    """Start the daemon unless one is already listening; True once it accepts connections."""
+    _private_dir(socket_path)
+    if _daemon_alive(socket_path):
+        return True
+
+    # Serialize concurrent session start-ups so only one of them spawns the daemon
+    with _open_private(socket_path + ".lock", os.O_WRONLY) as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if _daemon_alive(socket_path):
+            return True
+
+        sys.stderr.write(f"🚀 Starting search daemon on {socket_path}\n")
+        with _open_private(socket_path + ".log", os.O_WRONLY | os.O_APPEND) as log:
+            proc = subprocess.Popen(
+                [sys.executable, str(Path(__file__).resolve()), "--daemon"],
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=log,
+                env={**os.environ, "SEARCH_DAEMON_SOCKET": socket_path},
+                start_new_session=True,
+            )
+
+        deadline = time.monotonic() + DAEMON_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if _daemon_alive(socket_path):
+                return True
+            if proc.poll() is not None:
+                sys.stderr.write(f"❌ Search daemon exited ({proc.returncode}), see {socket_path}.log\n")
+                return False
+            time.sleep(0.1)
+        sys.stderr.write(f"❌ Search daemon not ready after {DAEMON_START_TIMEOUT:g}s\n")
+        return False
+
+
+class DaemonDropped(Exception):
+    """The daemon accepted a request but closed the connection or sent garbage instead of a reply."""
+
+
+class DaemonClient:
+    """Line-delimited JSON-RPC connection to the search daemon."""
+
+    def __init__(self, socket_path: str = DAEMON_SOCKET):
+        _check_socket_owner(socket_path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.rfile = self.sock.makefile("rb")
+
+    def request(self, request: dict) -> dict | None:
+        self.sock.sendall(json.dumps(request).encode() + b"\n")
+        line = self.rfile.readline()
+        if not line:
+            raise DaemonDropped("search daemon closed the connection")
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            raise DaemonDropped(f"bad reply from search daemon: {e}") from e
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def _with_proxy_stats(request: dict, response: dict | None) -> dict | None:
+    """Add this proxy's own metrics (stdout writes, daemon round trips) to a server_stats reply."""
+    if not (isinstance(request, dict) and request.get("method") == "tools/call"
+            and isinstance(request.get("params"), dict) and request["params"].get("name") == "server_stats"):
+        return response
+    try:
+        content = response["result"]["content"][0]
+        stats = json.loads(content["text"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return response
+    stats["proxy"] = METRICS.snapshot()
+    content["text"] = json.dumps(stats, indent=2)
+    return response
+
+
+def run_proxy(socket_path: str = DAEMON_SOCKET):
+    """Serve MCP on stdio by forwarding every request to the shared daemon.
+
+    Starts the daemon if needed and restarts it once if it dies mid-session;
+    if its socket still cannot be reached, falls back to an in-process server.
+    A request the daemon drops is answered with an error, without falling back.
+    """
+    sys.stderr.write(f"🦞 Lena Docs Search MCP proxy → {socket_path}\n")
+    client = None
+    local = None
+
+    def handle(request: dict) -> dict | None:
+        nonlocal client, local
+        if local is not None:
+            return local.handle_request(request)
+        for _ in range(2):
+            try:
+                if client is None:
+                    if not ensure_daemon(socket_path):
+                        break
+                    client = DaemonClient(socket_path)
+                with METRICS.timer("daemon_roundtrip"):
+                    response = client.request(request)
+                return _with_proxy_stats(request, response)
+            except DaemonDropped as e:
+                sys.stderr.write(f"⚠ {e}\n")
+                client.close()
+                client = None  # reconnect (restarting the daemon if it died) on the next request
+                if not isinstance(request, dict) or "id" not in request:
+                    return None
+                return make_error(request["id"], -32603, str(e))
+            except OSError as e:
+                sys.stderr.write(f"⚠ Search daemon connection lost: {e}\n")
+                if client is not None:
+                    client.close()
+                    client = None
+        sys.stderr.write("⚠ Search daemon unavailable, serving in-process\n")
+        local = VectorSearchServer()
+        return local.handle_request(request)
+
+    serve_stdio(handle)
+    if client is not None:
+        client.close()
 
 
 if __name__ == "__main__":
-    server = VectorSearchServer()
-    server.run()
+    if "--daemon" in sys.argv[1:]:
+        run_daemon()
+    elif "--no-daemon" in sys.argv[1:] or not DAEMON_ENABLED:
+        server = VectorSearchServer()
+        server.run()
+    else:
+        run_proxy()
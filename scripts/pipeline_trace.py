@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Lena Pipeline Trace — tracing spans and opt-in profiling for crawl / vectorize runs
+Shared by crawl_docs_to_pdf.py and vectorize_docs.py.
+
+Every stage of every item (navigate, render, pdf_write, extract, chunk, embed,
+index_add, …) runs inside a span. With tracing on, each finished span is written
+as one event:
+  - *.json  → Chrome trace-event format (open in chrome://tracing or ui.perfetto.dev)
+  - other   → JSONL, one {"name", "start", "duration_ms", "parent", …} object per line
+The file is streamed, so a crashed run still leaves a usable trace.
+
+Profiling is per stage: the selected stages run under cProfile (one profile per
+stage, accumulated over all items) and, optionally, tracemalloc. Stages nest
+(embed_document → embed, build_index → index_add, page → render, …); while a
+nested profiled stage runs the enclosing stage's profiler is paused, so each
+profile holds only the time not already in a nested stage's profile. Reports are
+saved when the run exits:
+  <stage>.prof / <stage>.txt   cProfile data (snakeviz, pstats) + top functions by cumulative time
+  memory.txt                   top allocation sites still alive at exit
+With tracemalloc on, every span also records the memory it allocated and its peak.
+
+Environment:
+  PIPELINE_TRACE=trace.json          write spans to this file (unset: no trace)
+  PIPELINE_PROFILE=embed,index_add   stages to profile ("all" for every stage)
+  PIPELINE_PROFILE_MEMORY=1          also track allocations with tracemalloc
+  PIPELINE_PROFILE_DIR=../profiles   where profile reports are written
+
+With nothing enabled a span costs two perf_counter() calls.
+"""
+
+import atexit
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+
+# ── Config ─────────────────────────────────────────────────────
+BASE_DIR = Path(__file__).resolve().parent.parent
+TRACE_PATH = os.environ.get("PIPELINE_TRACE", "")
+PROFILE_STAGES = os.environ.get("PIPELINE_PROFILE", "")
+PROFILE_MEMORY = os.environ.get("PIPELINE_PROFILE_MEMORY", "0") == "1"
+PROFILE_DIR = Path(os.environ.get("PIPELINE_PROFILE_DIR", str(BASE_DIR / "profiles")))
+PROFILE_TOP = 40  # functions / allocation sites listed in the text reports
+
+_parent = contextvars.ContextVar("pipeline_span", default=None)
+
+
+class Tracer:
+    """Records spans to a trace file and runs selected stages under cProfile/tracemalloc."""
+
+    def __init__(self, path: str = "", profile: str = "", memory: bool = False,
+                 profile_dir: Path = PROFILE_DIR):
+        self._lock = threading.Lock()
+        self._file = None
+        self._events = 0
+        self._active: list[cProfile.Profile] = []  # profilers of the open profiled spans, innermost last
+        self._open_marks: list[dict] = []  # memory marks of the spans currently open
+        self.profiles: dict[str, cProfile.Profile] = {}
+        self.totals: dict[str, list[float]] = {}  # stage → [count, seconds]
+        self.configure(path, profile, memory, profile_dir)
+
+    def configure(self, path: str = "", profile: str = "", memory: bool = False,
+                  profile_dir: Path | None = None) -> None:
+        """(Re)configure before the first span, e.g. from command-line flags."""
+        self.path = Path(path) if path else None
+        self.chrome = self.path is not None and self.path.suffix == ".json"
+        self.profile_stages = {s.strip() for s in profile.split(",") if s.strip()}
+        self.memory = memory
+        if profile_dir is not None:
+            self.profile_dir = profile_dir
+        self.enabled = bool(self.path or self.profile_stages or self.memory)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        return cls(TRACE_PATH, PROFILE_STAGES, PROFILE_MEMORY)
+
+    def _profile_for(self, name: str):
+        """The stage's profiler, or None if profiling is off for it."""
+        if not (name in self.profile_stages or "all" in self.profile_stages):
+            return None
+        profile = self.profiles.get(name)
+        if profile is None:
+            profile = self.profiles[name] = cProfile.Profile()
+        return profile
+
+    def _begin(self, name: str):
+        if not self.enabled:
+            return None
+        profile = self._profile_for(name)
+        if profile is not None:
+            # Only one profiler can be active at a time: pause the enclosing stage's
+            if self._active:
+                self._active[-1].disable()
+            self._active.append(profile)
+            profile.enable()
+        mark = None
+        if self.memory:
+            with self._lock:
+                self._fold_peak()
+                current = tracemalloc.get_traced_memory()[0]
+                mark = {"start": current, "peak": current}
+                self._open_marks.append(mark)
+        return profile, mark, _parent.set(name)
+
+    def _fold_peak(self) -> None:
+        """Credit the peak since the last reset to every open span, then reset it.
+
+        tracemalloc has a single global peak, so a child span resetting it must
+        not erase the part of its parent's peak reached before the child began.
+        """
+        peak = tracemalloc.get_traced_memory()[1]
+        for mark in self._open_marks:
+            if peak > mark["peak"]:
+                mark["peak"] = peak
+        tracemalloc.reset_peak()
+
+    def _end(self, name: str, start: float, state, args: dict) -> None:
+        duration = time.perf_counter() - start
+        if state is None:
+            return
+        profile, mark, token = state
+        if profile is not None:
+            profile.disable()
+            self._active.pop()
+            if self._active:
+                self._active[-1].enable()
+        _parent.reset(token)
+        if mark is not None:
+            with self._lock:
+                self._fold_peak()
+                self._open_marks.remove(mark)
+            current = tracemalloc.get_traced_memory()[0]
+            args["alloc_kb"] = round((current - mark["start"]) / 1024, 1)
+            args["peak_kb"] = round((mark["peak"] - mark["start"]) / 1024, 1)
+        with self._lock:
+            totals = self.totals.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += duration
+        if self.path is not None:
+            self._write(name, start, duration, _parent.get(), args)
+
+    @contextmanager
+    def span(self, name: str, **args):
+        """Trace (and maybe profile) the enclosed block as stage `name`.
+
+        Yields the span's args dict, so results known only at the end
+        (chunk counts, bytes, status) can be attached to the event.
+        """
+        state = self._begin(name)
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self._end(name, start, state, args)
+
+    @asynccontextmanager
+    async def aspan(self, name: str, **args):
+        """Async version of `span`, for stages that await (Playwright calls)."""
+        state = self._begin(name)
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self._end(name, start, state, args)
+
+    def _write(self, name: str, start: float, duration: float, parent: str | None, args: dict) -> None:
+        if self.chrome:
+            event = {
+                "name": name, "cat": "pipeline", "ph": "X",
+                "ts": round(start * 1e6, 1), "dur": round(duration * 1e6, 1),
+                "pid": os.getpid(), "tid": threading.get_ident(), "args": args,
+            }
+        else:
+            event = {
+                "name": name, "start": round(start, 6), "duration_ms": round(duration * 1000, 3),
+                "parent": parent, **args,
+            }
+        line = json.dumps(event, default=str)
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "w")
+                if self.chrome:
+                    self._file.write("[\n")  # trace viewers accept an unterminated array
+            if self.chrome and self._events:
+                line = ",\n" + line
+            elif not self.chrome:
+                line += "\n"
+            self._file.write(line)
+            self._events += 1
+
+    def save_profiles(self) -> list[Path]:
+        """Write cProfile and tracemalloc reports for the profiled stages."""
+        written = []
+        if not self.profiles and not self.memory:
+            return written
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        for stage, profile in self.profiles.items():
+            prof_path = self.profile_dir / f"{stage}.prof"
+            profile.dump_stats(str(prof_path))
+            report = io.StringIO()
+            pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            txt_path = self.profile_dir / f"{stage}.txt"
+            txt_path.write_text(report.getvalue())
+            written += [prof_path, txt_path]
+        if self.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            lines = [f"traced: {current / 1024 / 1024:.1f}MB now, {peak / 1024 / 1024:.1f}MB peak since the last span ended", ""]
+            for stat in tracemalloc.take_snapshot().statistics("lineno")[:PROFILE_TOP]:
+                lines.append(str(stat))
+            mem_path = self.profile_dir / "memory.txt"
+            mem_path.write_text("\n".join(lines) + "\n")
+            written.append(mem_path)
+        return written
+
+    def summary(self) -> str:
+        """One line per stage: count, total and mean time."""
+        lines = []
+        for name, (count, seconds) in sorted(self.totals.items(), key=lambda kv: -kv[1][1]):
+            lines.append(f"  {name:<14} {count:>6}× {seconds:>8.2f}s total, {seconds / count * 1000:>8.1f}ms avg")
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        """Finish the trace file, save profile reports and print the stage summary."""
+        if not self.enabled:
+            return
+        self.enabled = False
+        with self._lock:
+            if self._file is not None:
+                if self.chrome:
+                    self._file.write("\n]\n")
+                self._file.close()
+                self._file = None
+        written = self.save_profiles()
+        if self.totals:
+            print(f"⏱ Stage timings:\n{self.summary()}")
+        if self.path is not None and self._events:
+            print(f"📈 Trace: {self.path} ({self._events} spans)")
+        for path in written:
+            print(f"🔬 Profile: {path}")
+
+
+TRACE = Tracer.from_env()
+atexit.register(TRACE.close)
@@ -1,32 +1,69 @@
 #!/usr/bin/env python3
 """
 Lena Vectorizer — Convert PDF docs to FAISS vector index
-Uses Ollama (Qwen 3 7B Instruct) for embeddings + FAISS for indexing.
+Uses a pluggable embedder (see embedders.py; Ollama Qwen3-Embedding-8B by default)
++ FAISS for indexing.
+
+Usage:
+  python3 vectorize_docs.py                          # Ollama (EMBED_BACKEND=ollama)
+  EMBED_BACKEND=local python3 vectorize_docs.py      # in-process CPU model
+  EMBED_BACKEND=hashing python3 vectorize_docs.py    # deterministic, for tests
+
+  # Index another corpus (PDFs + text/code files) as a separate collection
+  python3 vectorize_docs.py --collection mcp_reference --input ../mcp_reference \
+      --description "Reference MCP server implementations"
+
+Each collection is written to ../vectordb/<name>.faiss, <name>_metadata.json and
+<name>_index_info.json, and registered in ../vectordb/collections.json for
+mcp_vector_search.py.
+
+Embedded chunks are checkpointed to ../vectordb/.<name>_checkpoint/ as they are
+produced. Re-running after a crash resumes where the last run stopped (same
+embedder and chunking only); pass --restart to discard the checkpoint.
+
+Tracing / profiling (see pipeline_trace.py):
+  python3 vectorize_docs.py --trace ../trace.json              # Chrome trace of every stage
+  python3 vectorize_docs.py --profile embed,index_add --profile-memory
 
 Requires:
   pip install faiss-cpu PyPDF2 requests
-  ollama pull qwen3:7b-instruct
+  ollama pull qwen3-embedding:8b
 """
 
+import argparse
+import hashlib
 import json
 import os
 import re
+import shutil
 import struct
 import sys
+import time
+from array import array
+from datetime import datetime, timezone
 from pathlib import Path
 
-import requests
+from embedders import CircuitOpenError, get_embedder
+from pipeline_trace import TRACE
 
 # ── Config ─────────────────────────────────────────────────────
-OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
-EMBED_MODEL = "qwen3-embedding:8b"
 CHUNK_SIZE = 512   # tokens (~2000 chars)
 CHUNK_OVERLAP = 64 # tokens (~256 chars)
-EMBED_DIM = 4096   # Qwen3-Embedding-8B dimension (#1 MTEB)
+CHUNK_CHARS = 2000
+CHUNK_OVERLAP_CHARS = 256
+OUTAGE_RETRIES = 20  # breaker cooldowns to sit out before giving up on a batch
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 DOCS_DIR = BASE_DIR / "docs"
 VECTORDB_DIR = BASE_DIR / "vectordb"
+MANIFEST_PATH = VECTORDB_DIR / "collections.json"
+DEFAULT_COLLECTION = "docs"
+DEFAULT_DESCRIPTION = "OpenCode, OpenClaw and Oh My OpenCode documentation"
+
+TEXT_SUFFIXES = {".md", ".mdx", ".txt", ".rst", ".py", ".ts", ".tsx", ".js", ".go", ".rs",
+                 ".json", ".yaml", ".yml", ".toml"}
+SKIP_DIRS = {"node_modules", "dist", "build", "vendor", "__pycache__"}
+MAX_TEXT_FILE_BYTES = 1_000_000
 
 
 def extract_text_from_pdf(pdf_path: Path) -> str:
@@ -44,7 +81,47 @@ def extract_text_from_pdf(pdf_path: Path) -> str:
     return text
 
 
-def chunk_text(text: str, chunk_size: int = 2000, overlap: int = 256) -> list[str]:
+def discover_inputs(input_dir: Path) -> list[Path]:
+    """PDFs and text/code files under `input_dir`, skipping hidden and build directories."""
+    files = []
+    for path in sorted(input_dir.rglob("*")):
+        rel_dirs = path.relative_to(input_dir).parts[:-1]
+        if any(part.startswith(".") or part in SKIP_DIRS for part in rel_dirs):
+            continue
+        if not path.is_file():
+            continue
+        if path.suffix == ".pdf":
+            files.append(path)
+        elif path.suffix in TEXT_SUFFIXES and path.stat().st_size <= MAX_TEXT_FILE_BYTES:
+            files.append(path)
+    return files
+
+
+def extract_text(path: Path) -> str:
+    if path.suffix == ".pdf":
+        return extract_text_from_pdf(path)
+    return path.read_text(errors="ignore")
+
+
+def describe_source(path: Path, input_dir: Path, collection: str) -> tuple[str, str]:
+    """(section, source) for a file: section is its top-level directory under the input."""
+    rel = path.relative_to(input_dir)
+    section = rel.parts[0] if len(rel.parts) > 1 else collection
+    if path.suffix == ".pdf":
+        return section, f"{section}/{path.stem}"  # docs/<section>/pdf/<page>.pdf
+    return section, rel.as_posix()
+
+
+def file_digest(path: Path) -> str:
+    """Content hash of an input file, so a re-crawled document is not resumed from stale chunks."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP_CHARS) -> list[str]:
     """Split text into overlapping chunks by character count."""
     chunks = []
     start = 0
@@ -65,27 +142,231 @@ def chunk_text(text: str, chunk_size: int = 2000, overlap: int = 256) -> list[st
     return chunks
 
 
-def get_embedding(text: str) -> list[float]:
-    """Get embedding from Ollama."""
-    resp = requests.post(
-        f"{OLLAMA_HOST}/api/embed",
-        json={"model": EMBED_MODEL, "input": text},
-        timeout=120,
-    )
-    resp.raise_for_status()
-    data = resp.json()
-    # Ollama returns {"embeddings": [[...]]}
-    return data["embeddings"][0]
-
-
-def build_index(chunks: list[dict]) -> None:
+def embed_with_outage_wait(embedder, batch: list[str]) -> list[list[float]]:
+    """Embed a batch, sitting out circuit-breaker cooldowns instead of dropping chunks."""
+    for _ in range(OUTAGE_RETRIES):
+        try:
+            return embedder.embed(batch)
+        except CircuitOpenError as e:
+            print(f"    ⏸ {e}, waiting...")
+            time.sleep(e.retry_after + 0.1)
+    return embedder.embed(batch)
+
+
+def embed_chunks(embedder, chunks: list[str], on_batch=None) -> list[list[float] | None]:
+    """Embed chunks in batches; a failed batch is retried chunk by chunk.
+
+    `on_batch(start, vectors)` is called after each batch, e.g. to checkpoint it.
+    """
+    vectors = []
+    step = embedder.batch_size
+    for start in range(0, len(chunks), step):
+        batch = chunks[start:start + step]
+        print(f"    Embedding chunks {start+1}-{start+len(batch)}/{len(chunks)}...", end="\r")
+        try:
+            with TRACE.span("embed", chunks=len(batch)):
+                batch_vectors = embed_with_outage_wait(embedder, batch)
+        except Exception as e:
+            print(f"    ⚠ Batch {start+1}-{start+len(batch)} failed ({e}), retrying one by one")
+            batch_vectors = []
+            for j, chunk in enumerate(batch, start + 1):
+                try:
+                    with TRACE.span("embed", chunks=1, retry=True):
+                        batch_vectors.append(embed_with_outage_wait(embedder, [chunk])[0])
+                except Exception as e:
+                    print(f"    ❌ Chunk {j} failed: {e}")
+                    batch_vectors.append(None)
+        vectors.extend(batch_vectors)
+        if on_batch is not None:
+            with TRACE.span("checkpoint", chunks=len(batch_vectors)):
+                on_batch(start, batch_vectors)
+    return vectors
+
+
+class CheckpointStore:
+    """Append-only log of embedded chunks, so an interrupted run can resume.
+
+    Each run appends to a new segment file (segment-0001.bin, …); earlier
+    segments are never rewritten, so a crash can at most truncate the tail of
+    the newest one. A record is `<II` (metadata length, vector dim) followed by
+    the JSON metadata and the float32 vector. Document records (dim 0) mark a
+    source whose chunks are all embedded. Every record carries the content hash
+    (`doc`) of the file it came from; records of an older version are discarded.
+    """
+
+    HEADER = struct.Struct("<II")
+
+    def __init__(self, directory: Path, fingerprint: dict):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.chunks: dict[tuple[str, int], dict] = {}
+        self.done_docs: dict[str, str | None] = {}  # source → content hash
+        self._segment = None
+
+    def open(self, restart: bool = False) -> None:
+        """Load existing segments (unless restarting) and start a new one."""
+        if restart and self.directory.exists():
+            shutil.rmtree(self.directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        fingerprint_path = self.directory / "fingerprint.json"
+        if fingerprint_path.exists():
+            with open(fingerprint_path) as f:
+                previous = json.load(f)
+            if previous != self.fingerprint:
+                raise ValueError(
+                    f"checkpoint in {self.directory} was made with {previous}, "
+                    f"this run uses {self.fingerprint}; rerun with --restart"
+                )
+        else:
+            with open(fingerprint_path, "w") as f:
+                json.dump(self.fingerprint, f, indent=2)
+
+        segments = sorted(self.directory.glob("segment-*.bin"))
+        for segment in segments:
+            self._read_segment(segment)
+        self._segment = open(self.directory / f"segment-{len(segments) + 1:04d}.bin", "ab")
+
+    def _read_segment(self, path: Path) -> None:
+        data = path.read_bytes()
+        pos = 0
+        while pos + self.HEADER.size <= len(data):
+            meta_len, dim = self.HEADER.unpack_from(data, pos)
+            end = pos + self.HEADER.size + meta_len + 4 * dim
+            if end > len(data):
+                break
+            meta = json.loads(data[pos + self.HEADER.size:pos + self.HEADER.size + meta_len])
+            if dim:
+                vector = array("f")
+                vector.frombytes(data[end - 4 * dim:end])
+                meta["embedding"] = vector.tolist()
+                self.chunks[(meta["source"], meta["chunk"])] = meta
+            else:
+                self.done_docs[meta["source"]] = meta.get("doc")
+            pos = end
+        if pos < len(data):
+            print(f"  ⚠ Ignoring {len(data) - pos} bytes of a partial record at the end of {path.name}")
+
+    def _append(self, meta: dict, vector: list[float] | None = None) -> None:
+        payload = json.dumps(meta).encode()
+        floats = array("f", vector or [])
+        self._segment.write(self.HEADER.pack(len(payload), len(floats)) + payload + floats.tobytes())
+
+    def append_chunk(self, chunk: dict) -> None:
+        self._append({k: v for k, v in chunk.items() if k != "embedding"}, chunk["embedding"])
+        self.chunks[(chunk["source"], chunk["chunk"])] = chunk
+
+    def mark_done(self, source: str, doc: str) -> None:
+        self._append({"source": source, "doc": doc})
+        self.done_docs[source] = doc
+
+    def discard_stale(self, source: str, doc: str) -> int:
+        """Forget records of `source` made from other content than `doc`; returns chunks dropped."""
+        if source in self.done_docs and self.done_docs[source] != doc:
+            del self.done_docs[source]
+        stale = [key for key, c in self.chunks.items() if key[0] == source and c.get("doc") != doc]
+        for key in stale:
+            del self.chunks[key]
+        return len(stale)
+
+    def flush(self, durable: bool = False) -> None:
+        self._segment.flush()
+        if durable:
+            os.fsync(self._segment.fileno())
+
+    def ordered_chunks(self, sources: list[str]) -> list[dict]:
+        """Checkpointed chunks of `sources`, in source order then chunk order."""
+        order = {source: i for i, source in enumerate(sources)}
+        chunks = [c for (source, _), c in self.chunks.items() if source in order]
+        return sorted(chunks, key=lambda c: (order[c["source"]], c["chunk"]))
+
+    def remove(self) -> None:
+        self._segment.close()
+        shutil.rmtree(self.directory)
+
+
+def link_chunks(chunks: list[dict]) -> None:
+    """Give every chunk a stable ID and precompute prev/next neighbour IDs within its source."""
+    previous = None
+    for c in chunks:
+        c["id"] = f"{c['source']}#{c['chunk']}"
+        c["prev"] = None
+        c["next"] = None
+        if previous is not None and previous["source"] == c["source"]:
+            previous["next"] = c["id"]
+            c["prev"] = previous["id"]
+        previous = c
+
+
+def chunk_metadata(c: dict) -> dict:
+    """Per-chunk metadata stored next to the vectors (same row order as the index)."""
+    return {
+        "id": c["id"],
+        "source": c["source"],
+        "section": c["section"],
+        "text": c["text"],
+        "prev": c["prev"],
+        "next": c["next"],
+    }
+
+
+def write_atomically(path: Path, write) -> None:
+    """Call `write(tmp_path)` then rename over `path`, so a running search daemon never reads a partial file."""
+    tmp = path.with_name(path.name + ".tmp")
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def write_json(path: Path, data, **kwargs) -> None:
+    def write(tmp):
+        with open(tmp, "w") as f:
+            json.dump(data, f, **kwargs)
+    write_atomically(path, write)
+
+
+def write_index_info(embedder, chunks: list[dict], dim: int, collection: str) -> None:
+    """Record which backend/model produced the vectors so the server can refuse to mix them."""
+    info = {
+        **embedder.info(),
+        "dim": dim,
+        "vectors": len(chunks),
+        "sections": sorted({c["section"] for c in chunks}),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    path = VECTORDB_DIR / f"{collection}_index_info.json"
+    write_json(path, info, indent=2)
+    print(f"  ✅ Index info: {path} ({info['backend']}:{info['model']})")
+
+
+def register_collection(collection: str, description: str) -> None:
+    """Add or update the collection in the manifest read by mcp_vector_search.py."""
+    if MANIFEST_PATH.exists():
+        with open(MANIFEST_PATH) as f:
+            manifest = json.load(f)
+    else:
+        manifest = {"default": DEFAULT_COLLECTION, "collections": {}}
+        # Keep serving a docs index built before the manifest existed
+        if collection != DEFAULT_COLLECTION and (VECTORDB_DIR / f"{DEFAULT_COLLECTION}.faiss").exists():
+            manifest["collections"][DEFAULT_COLLECTION] = {"description": DEFAULT_DESCRIPTION}
+    entry = manifest["collections"].setdefault(collection, {})
+    if description:
+        entry["description"] = description
+    if manifest.get("default") not in manifest["collections"]:
+        manifest["default"] = collection
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"  ✅ Registered collection '{collection}' in {MANIFEST_PATH}")
+
+
+def build_index(chunks: list[dict], embedder, collection: str = DEFAULT_COLLECTION) -> None:
     """Build FAISS index from chunks with embeddings."""
     try:
         import faiss
     except ImportError:
         # Fallback: save embeddings as numpy-like binary
         print("⚠ FAISS not available — saving raw embeddings + metadata")
-        save_raw_embeddings(chunks)
+        save_raw_embeddings(chunks, collection)
+        write_index_info(embedder, chunks, len(chunks[0]["embedding"]), collection)
         return
 
     import numpy as np
@@ -102,101 +383,190 @@ def build_index(chunks: list[dict]) -> None:
     # Normalize for cosine similarity
     faiss.normalize_L2(embeddings)
 
-    index.train(embeddings)
-    index.add(embeddings)
+    with TRACE.span("index_train", vectors=n, nlist=nlist):
+        index.train(embeddings)
+    with TRACE.span("index_add", vectors=n, dim=dim):
+        index.add(embeddings)
 
     # Save index
-    index_path = VECTORDB_DIR / "docs.faiss"
-    faiss.write_index(index, str(index_path))
+    index_path = VECTORDB_DIR / f"{collection}.faiss"
+    with TRACE.span("index_write"):
+        write_atomically(index_path, lambda tmp: faiss.write_index(index, str(tmp)))
     print(f"  ✅ FAISS index: {index_path} ({n} vectors, dim={dim})")
 
     # Save metadata
-    metadata = [{"source": c["source"], "text": c["text"], "section": c["section"]} for c in chunks]
-    meta_path = VECTORDB_DIR / "docs_metadata.json"
-    with open(meta_path, "w") as f:
-        json.dump(metadata, f, indent=2)
+    metadata = [chunk_metadata(c) for c in chunks]
+    meta_path = VECTORDB_DIR / f"{collection}_metadata.json"
+    with TRACE.span("metadata_write"):
+        write_json(meta_path, metadata, indent=2)
     print(f"  ✅ Metadata: {meta_path}")
 
+    write_index_info(embedder, chunks, dim, collection)
+
 
-def save_raw_embeddings(chunks: list[dict]) -> None:
+def save_raw_embeddings(chunks: list[dict], collection: str = DEFAULT_COLLECTION) -> None:
     """Fallback: save embeddings as JSON (no FAISS)."""
     output = []
     for c in chunks:
-        output.append({
-            "source": c["source"],
-            "section": c["section"],
-            "text": c["text"],
-            "embedding": c["embedding"],
-        })
-
-    path = VECTORDB_DIR / "docs_vectors.json"
-    with open(path, "w") as f:
-        json.dump(output, f)
+        output.append({**chunk_metadata(c), "embedding": c["embedding"]})
+
+    path = VECTORDB_DIR / f"{collection}_vectors.json"
+    write_json(path, output)
     print(f"  ✅ Raw embeddings: {path} ({len(output)} vectors)")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Vectorize documents into a FAISS collection")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION,
+                        help=f"collection name (default: {DEFAULT_COLLECTION})")
+    parser.add_argument("--input", type=Path, default=None,
+                        help="directory to index (default: ../docs PDFs for the docs collection)")
+    parser.add_argument("--description", default=None, help="one-line description shown to agents")
+    parser.add_argument("--restart", action="store_true",
+                        help="discard the checkpoint of an interrupted run and start from zero")
+    parser.add_argument("--keep-checkpoint", action="store_true",
+                        help="keep the checkpoint after the index is built")
+    parser.add_argument("--trace", default=None, metavar="PATH",
+                        help="write stage spans to PATH (.json: Chrome trace events, else JSONL)")
+    parser.add_argument("--profile", default=None, metavar="STAGES",
+                        help="comma-separated stages to run under cProfile, or 'all'")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="also track allocations per span with tracemalloc")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
+    collection = args.collection
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", collection):
+        print(f"❌ Invalid collection name: {collection}")
+        sys.exit(1)
     VECTORDB_DIR.mkdir(parents=True, exist_ok=True)
-
-    # Discover all PDFs
-    pdf_files = sorted(DOCS_DIR.rglob("*.pdf"))
+    if args.trace or args.profile or args.profile_memory:
+        TRACE.configure(
+            args.trace or str(TRACE.path or ""),
+            args.profile or ",".join(TRACE.profile_stages),
+            args.profile_memory or TRACE.memory,
+        )
+
+    # Discover inputs: the crawled PDFs for docs, PDFs + text/code files otherwise
+    input_dir = (args.input or DOCS_DIR).resolve()
+    if args.input is None:
+        pdf_files = sorted(input_dir.rglob("*.pdf"))
+    else:
+        pdf_files = discover_inputs(input_dir)
     if not pdf_files:
-        print("❌ No PDFs found. Run crawl_docs_to_pdf.py first.")
+        print(f"❌ No documents found in {input_dir}. Run crawl_docs_to_pdf.py first.")
+        sys.exit(1)
+
+    try:
+        embedder = get_embedder(bulk=True)
+    except (ValueError, RuntimeError) as e:
+        print(f"❌ {e}")
         sys.exit(1)
 
-    print(f"📚 Found {len(pdf_files)} PDFs")
-    print(f"🤖 Embedding model: {EMBED_MODEL} via {OLLAMA_HOST}")
+    print(f"📚 Found {len(pdf_files)} documents for collection '{collection}'")
+    print(f"🤖 Embedding model: {embedder.describe()}")
     print(f"📁 Output: {VECTORDB_DIR}")
 
-    # Check Ollama connectivity
+    # Check the embedding backend is reachable
     try:
-        resp = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=5)
-        models = [m["name"] for m in resp.json().get("models", [])]
-        if not any(EMBED_MODEL in m for m in models):
-            print(f"⚠ Model {EMBED_MODEL} not found. Available: {models}")
-            print(f"  Run: ollama pull {EMBED_MODEL}")
-            sys.exit(1)
-    except Exception as e:
-        print(f"❌ Cannot reach Ollama at {OLLAMA_HOST}: {e}")
+        embedder.check()
+    except RuntimeError as e:
+        print(f"❌ {e}")
         sys.exit(1)
 
-    all_chunks = []
+    # Resume from the checkpoint of an interrupted run with the same settings
+    store = CheckpointStore(
+        VECTORDB_DIR / f".{collection}_checkpoint",
+        {
+            "collection": collection,
+            "input": str(input_dir),
+            "backend": embedder.backend,
+            "model": embedder.model,
+            "chunk_size": CHUNK_CHARS,
+            "chunk_overlap": CHUNK_OVERLAP_CHARS,
+        },
+    )
+    try:
+        store.open(restart=args.restart)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if store.chunks:
+        print(f"♻ Resuming: {len(store.chunks)} chunks from {len(store.done_docs)} documents already embedded")
 
+    sources = []
     for i, pdf in enumerate(pdf_files, 1):
-        # Determine section from path
-        section = pdf.parent.parent.name  # opencode / openclaw / oh-my-opencode
-        print(f"\n[{i}/{len(pdf_files)}] {section}/{pdf.name}")
+        # Determine section from path: opencode / openclaw / oh-my-opencode for docs
+        section, source = describe_source(pdf, input_dir, collection)
+        sources.append(source)
+        print(f"\n[{i}/{len(pdf_files)}] {source}")
+        doc = file_digest(pdf)
+        stale = store.discard_stale(source, doc)
+        if stale:
+            print(f"  ♻ Changed since the checkpoint, dropping {stale} stale chunks")
+        if store.done_docs.get(source) == doc:
+            print("  ⏭ Already embedded (checkpoint)")
+            continue
 
-        text = extract_text_from_pdf(pdf)
+        with TRACE.span("extract", source=source) as span:
+            text = extract_text(pdf)
+            span["chars"] = len(text)
         if not text.strip():
-            print(f"  ⏭ Empty PDF, skipping")
+            print("  ⏭ Empty document, skipping")
+            store.mark_done(source, doc)
             continue
 
-        chunks = chunk_text(text)
-        print(f"  📄 {len(text)} chars → {len(chunks)} chunks")
-
-        for j, chunk in enumerate(chunks):
-            print(f"    Embedding chunk {j+1}/{len(chunks)}...", end="\r")
-            try:
-                embedding = get_embedding(chunk)
-                all_chunks.append({
-                    "source": f"{section}/{pdf.stem}",
-                    "section": section,
-                    "text": chunk,
-                    "embedding": embedding,
-                })
-            except Exception as e:
-                print(f"    ❌ Chunk {j+1} failed: {e}")
-
-        print(f"  ✅ {len(chunks)} chunks embedded")
-
+        with TRACE.span("chunk", source=source) as span:
+            chunks = chunk_text(text)
+            span["chunks"] = len(chunks)
+        todo = [j for j in range(len(chunks)) if (source, j) not in store.chunks]
+        print(f"  📄 {len(text)} chars → {len(chunks)} chunks ({len(chunks) - len(todo)} checkpointed)")
+
+        def checkpoint_batch(start, vectors):
+            for j, embedding in zip(todo[start:start + len(vectors)], vectors):
+                if embedding is not None:
+                    store.append_chunk({
+                        "source": source,
+                        "chunk": j,
+                        "doc": doc,
+                        "section": section,
+                        "text": chunks[j],
+                        "embedding": embedding,
+                    })
+            store.flush()
+
+        with TRACE.span("embed_document", source=source, chunks=len(todo)):
+            embed_chunks(embedder, [chunks[j] for j in todo], on_batch=checkpoint_batch)
+        embedded = sum((source, j) in store.chunks for j in range(len(chunks)))
+        if embedded == len(chunks):
+            store.mark_done(source, doc)
+        store.flush(durable=True)
+
+        print(f"  ✅ {embedded}/{len(chunks)} chunks embedded")
+
+    all_chunks = store.ordered_chunks(sources)
     print(f"\n{'='*60}")
-    print(f"📊 Total: {len(all_chunks)} chunks from {len(pdf_files)} PDFs")
+    print(f"📊 Total: {len(all_chunks)} chunks from {len(pdf_files)} documents")
 
     if all_chunks:
+        link_chunks(all_chunks)
         print("🔨 Building FAISS index...")
-        build_index(all_chunks)
-
+        with TRACE.span("build_index", vectors=len(all_chunks)):
+            build_index(all_chunks, embedder, collection)
+        description = args.description
+        if description is None and collection == DEFAULT_COLLECTION:
+            description = DEFAULT_DESCRIPTION
+        register_collection(collection, description)
+
+    if args.keep_checkpoint or len(store.done_docs.keys() & set(sources)) < len(sources):
+        store.flush(durable=True)
+        print(f"💾 Checkpoint kept in {store.directory} (rerun to retry failed chunks)")
+    else:
+        store.remove()
+
+    TRACE.close()
     print("🏁 Vectorization complete!")
 
 